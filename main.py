@@ -20,14 +20,22 @@ print = functools.partial(print, flush=True)
 def cleanup(signum, frame):
     """Clean up any resources before exiting."""
     if _ADAPTER is not None:
+        _ADAPTER.shutdown()
         _ADAPTER.close_proxy()
 
     sys.exit(0)
 
 
+def dump_log(signum, frame):
+    """Write the recent log events to a file, without stopping."""
+    if _ADAPTER is not None:
+        _ADAPTER.dump_log()
+
+
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, cleanup)
     signal.signal(signal.SIGTERM, cleanup)
+    signal.signal(signal.SIGUSR1, dump_log)
     _ADAPTER = ToothbrushAdapter(verbose=_DEBUG)
 
     # Wait until the proxy stops running, indicating that the gateway shut us
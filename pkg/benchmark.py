@@ -0,0 +1,156 @@
+"""Benchmark of the scan and poll pipeline of the Toothbrush adapter.
+
+Runs the real adapter against the simulated Bluetooth backend, without a gateway, for a growing
+number of toothbrushes, and reports how many of them were served, the property updates per second,
+the end-to-end update latency and the CPU time per toothbrush. A toothbrush counts as served if
+its data reached its thing at least once while measuring, changed or not. When there are fewer connection slots than
+toothbrushes that are brushing, the others have to wait, so that number can be lower. For example:
+
+    python3 -m pkg.benchmark --counts 1,10,100 --duration 10
+"""
+
+import sys
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+
+from .toothbrush import ToothbrushAdapter
+from .offline import OfflineAdapter
+from .simulator import SimulatedBackend
+from .metrics import LatencyHistogram
+
+
+_DEFAULT_COUNTS = (1, 2, 5, 10, 20, 50, 100)
+_DEFAULT_DURATION = 10 # seconds per run
+_WARMUP = 2 # seconds before measuring starts, to let the adapter discover the toothbrushes
+_SESSION_LENGTH = 30 # seconds that each simulated toothbrush brushes
+_REST_LENGTH = 90 # seconds between the sessions, so that about a quarter of the toothbrushes is brushing at any time
+
+
+
+class BenchmarkAdapter(ToothbrushAdapter, OfflineAdapter):
+    """The Toothbrush adapter, running against the simulator."""
+
+    def __init__(self, backend, dir_path, passive_mode, max_connections):
+        self.offline_dir_path = dir_path
+        self.benchmark_passive_mode = passive_mode
+        self.benchmark_max_connections = max_connections
+        ToothbrushAdapter.__init__(self, verbose=False, backend=backend)
+
+    def add_from_config(self):
+        self.DEBUG = False
+        self.passive_mode = self.benchmark_passive_mode
+        self.max_connections = self.benchmark_max_connections
+        self.controller_names = [controller for controller in self.backend.controllers if controller != None]
+
+    def start_bluetooth(self):
+        # Only warnings, so that writing the log doesn't skew the results
+        self.log.logger.setLevel(logging.WARNING)
+        super().start_bluetooth()
+
+
+
+def run(count, duration, passive_mode, max_connections, backend_options):
+    """Run the adapter with a number of simulated toothbrushes, and measure it."""
+    dir_path = tempfile.mkdtemp(prefix='toothbrush-benchmark-')
+    adapter = BenchmarkAdapter(SimulatedBackend(count, **backend_options), dir_path, passive_mode, max_connections)
+    try:
+        time.sleep(_WARMUP)
+        start_changes = adapter.manager_proxy.property_changes
+        start_latency = LatencyHistogram()
+        for metrics in list(adapter.metrics.devices.values()):
+            start_latency.merge(metrics.histograms['end_to_end'])
+        start_cpu = time.process_time()
+        start = time.monotonic()
+        start_time = time.time()
+
+        time.sleep(duration)
+
+        elapsed = time.monotonic() - start
+        cpu = time.process_time() - start_cpu
+        changes = adapter.manager_proxy.property_changes - start_changes
+        served = sum(1 for device in list(adapter.devices.values()) if max(device.data_times.values(), default=0) >= start_time)
+        latency = LatencyHistogram()
+        for metrics in list(adapter.metrics.devices.values()):
+            latency.merge(metrics.histograms['end_to_end'])
+    finally:
+        adapter.unload()
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+    # Only count the latencies that were measured after the warmup
+    for index, count_before in enumerate(start_latency.counts):
+        latency.counts[index] -= count_before
+    latency.count -= start_latency.count
+    latency.total -= start_latency.total
+
+    return {
+        'toothbrushes':count,
+        'things':len(adapter.devices),
+        'served':served,
+        'updates_per_second':changes / elapsed,
+        'p50':latency.percentile(0.5),
+        'p95':latency.percentile(0.95),
+        'p99':latency.percentile(0.99),
+        'cpu_ms_per_toothbrush':1000 * cpu / elapsed / count,
+    }
+
+
+
+def milliseconds(seconds):
+    return '-' if seconds == None else format(seconds * 1000, '.1f')
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Toothbrush adapter against simulated toothbrushes.")
+    parser.add_argument('--counts', default=",".join(str(count) for count in _DEFAULT_COUNTS), help="numbers of toothbrushes to simulate, comma separated")
+    parser.add_argument('--duration', type=float, default=_DEFAULT_DURATION, help="seconds to measure each run")
+    parser.add_argument('--mode', choices=('passive', 'connected', 'both'), default='both', help="decode advertisements, connect to the toothbrushes, or both")
+    parser.add_argument('--max-connections', type=int, default=3, help="connection slots per controller, as in the add-on settings")
+    parser.add_argument('--controllers', type=int, default=1, help="number of simulated Bluetooth controllers")
+    parser.add_argument('--connect-latency', type=float, default=0.2, help="average seconds a simulated connection takes")
+    parser.add_argument('--discovery-latency', type=float, default=1.5, help="average seconds it takes to discover the services of a simulated toothbrush")
+    parser.add_argument('--read-latency', type=float, default=0.03, help="average seconds a simulated GATT read takes")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of simulated connections and reads that fail")
+    parser.add_argument('--session-length', type=float, default=_SESSION_LENGTH, help="seconds that each simulated toothbrush brushes")
+    parser.add_argument('--rest-length', type=float, default=_REST_LENGTH, help="seconds that each simulated toothbrush rests between sessions")
+    parser.add_argument('--advertisement-interval', type=float, default=0.1, help="seconds between the advertisements of each toothbrush")
+    parser.add_argument('--neighbours', type=int, default=0, help="number of other advertising devices in range, such as phones")
+    parser.add_argument('--no-scan-filters', action='store_true', help="let the advertisements of the other devices reach the adapter, as without BlueZ scan filters")
+    args = parser.parse_args(argv)
+
+    backend_options = {
+        'connect_latency':args.connect_latency,
+        'discovery_latency':args.discovery_latency,
+        'read_latency':args.read_latency,
+        'failure_rate':args.failure_rate,
+        'session_length':args.session_length,
+        'rest_length':args.rest_length,
+        'advertisement_interval':args.advertisement_interval,
+        'neighbours':args.neighbours,
+        'scan_filters':not args.no_scan_filters,
+    }
+    if args.controllers > 1:
+        backend_options['controllers'] = ['hci' + str(index) for index in range(args.controllers)]
+    modes = ('passive', 'connected') if args.mode == 'both' else (args.mode,)
+
+    print("mode       brushes  things  served  updates/s  p50 ms  p95 ms  p99 ms  cpu ms/s per brush")
+    for mode in modes:
+        for count in [int(count) for count in args.counts.split(",")]:
+            result = run(count, args.duration, mode == 'passive', args.max_connections, backend_options)
+            print(mode.ljust(10),
+                  str(result['toothbrushes']).rjust(7),
+                  str(result['things']).rjust(7),
+                  str(result['served']).rjust(7),
+                  format(result['updates_per_second'], '.1f').rjust(10),
+                  milliseconds(result['p50']).rjust(7),
+                  milliseconds(result['p95']).rjust(7),
+                  milliseconds(result['p99']).rjust(7),
+                  format(result['cpu_ms_per_toothbrush'], '.2f').rjust(19))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
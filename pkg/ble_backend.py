@@ -0,0 +1,119 @@
+"""The Bluetooth backend of the Toothbrush adapter.
+
+The adapter only talks to the radio through a backend object, so that the same scanning and
+polling code can run against real toothbrushes (through BlueZ and bleak) or against the simulator
+in simulator.py. A backend provides:
+
+scanner(detection_callback, controller)
+                            -- an async context manager that calls detection_callback(ble_device, advertisement_data)
+                               for every advertisement the controller picks up while it is active
+connect(ble_device, name, disconnected_callback, cached_services, ble_device_callback, use_services_cache, controller)
+                            -- connect to a device through a controller, and return a client with is_connected, services,
+                               read_gatt_char, start_notify, stop_notify and disconnect, like a BleakClient. With
+                               use_services_cache the services that were discovered on an earlier connection are used.
+clear_cache(client)         -- forget the cached services of the device a client is connected to
+
+A controller is the name of a Bluetooth adapter, such as 'hci1', or None for the default one.
+
+Scanners only pass on advertisements of toothbrushes. Where BlueZ supports it, the scan is passive
+and BlueZ itself drops everything that does not match the manufacturer ID or a service UUID of a
+supported brand, so the advertisements of all the other devices around never reach Python.
+"""
+
+import uuid
+
+import bleak
+from bleak_retry_connector import BleakClientWithServiceCache, establish_connection
+
+from . import drivers
+
+try:
+    from bleak.assigned_numbers import AdvertisementDataType
+    from bleak.backends.bluezdbus.advertisement_monitor import OrPattern
+
+    # Manufacturer specific data starts with the company ID, and 128 bit UUIDs are sent with their bytes reversed
+    _OR_PATTERNS = [
+        OrPattern(0, AdvertisementDataType.MANUFACTURER_SPECIFIC_DATA, manufacturer_id.to_bytes(2, 'little'))
+        for manufacturer_id in drivers.MANUFACTURER_IDS
+    ] + [
+        OrPattern(0, data_type, uuid.UUID(service_uuid).bytes[::-1])
+        for service_uuid in drivers.SERVICE_UUIDS
+        for data_type in (AdvertisementDataType.COMPLETE_LIST_SERVICE_UUID128, AdvertisementDataType.INCOMPLETE_LIST_SERVICE_UUID128)
+    ]
+except ImportError:
+    _OR_PATTERNS = None # not BlueZ, or a bleak version without passive scanning
+
+
+
+class ToothbrushScanner:
+    """A BleakScanner that only passes on toothbrushes. It scans passively if it can, and actively if it must."""
+
+    def __init__(self, backend, detection_callback, controller=None):
+        self.backend = backend
+        self.detection_callback = detection_callback
+        self.controller = controller
+        self.scanner = None
+
+    async def __aenter__(self):
+        if self.backend.passive_scanning and _OR_PATTERNS != None:
+            try:
+                self.scanner = self.create_scanner('passive', bluez={'or_patterns':_OR_PATTERNS})
+                await self.scanner.start()
+                return self
+            except Exception as ex:
+                # For instance because BlueZ was not started with --experimental
+                print("Passive scanning is not available, using active scanning: ", ex)
+                self.backend.passive_scanning = False
+
+        self.scanner = self.create_scanner('active')
+        await self.scanner.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.scanner.stop()
+
+    def create_scanner(self, scanning_mode, **kwargs):
+        if self.controller != None:
+            kwargs['adapter'] = self.controller
+        return bleak.BleakScanner(detection_callback=self.detected, scanning_mode=scanning_mode, **kwargs)
+
+    def detected(self, ble_device, advertisement_data):
+        # Active scans get everything in range, and an OR pattern can match by chance, so check once more
+        if drivers.match(ble_device.name, advertisement_data.manufacturer_data, advertisement_data.service_uuids) != None:
+            self.detection_callback(ble_device, advertisement_data)
+
+
+
+class BleakBackend:
+    """Talks to real toothbrushes, using bleak."""
+
+    name = 'bleak'
+
+    def __init__(self, passive_scanning=True):
+        self.passive_scanning = passive_scanning # switched off for good once BlueZ turns out not to support it
+
+    def scanner(self, detection_callback, controller=None):
+        return ToothbrushScanner(self, detection_callback, controller)
+
+    async def connect(self, ble_device, name, disconnected_callback, cached_services=None, ble_device_callback=None, use_services_cache=False, controller=None):
+        # With use_services_cache, BlueZ's own copy of the services from an earlier connection is used.
+        # BlueZ connects through the controller that found the ble_device, so that should be the device as the controller saw it.
+        kwargs = {}
+        if controller != None:
+            kwargs['adapter'] = controller
+        return await establish_connection(
+            BleakClientWithServiceCache,
+            ble_device,
+            name,
+            disconnected_callback,
+            cached_services=cached_services,
+            ble_device_callback=ble_device_callback,
+            use_services_cache=use_services_cache,
+            **kwargs
+        )
+
+    async def clear_cache(self, client):
+        try:
+            await client.clear_cache()
+        except Exception as ex:
+            print("could not clear the GATT service cache of BlueZ: ", ex)
@@ -0,0 +1,207 @@
+"""Capture files of the Bluetooth traffic the Toothbrush adapter has seen.
+
+If the 'Record Bluetooth traffic' option is enabled, every advertisement the scanner picks up, and
+every GATT read and notification of a toothbrush, is written to a capture file in the captures
+directory. replay.py can feed such a file back through the adapter, to reproduce a problem without
+the toothbrush that caused it.
+
+A capture file starts with a header, followed by records that each start with:
+
+time (double), kind (byte), device number (unsigned short), payload length (unsigned short)
+
+The payload depends on the kind:
+
+DEVICE        -- announces a device number: the address and the name, separated by a zero byte
+ADVERTISEMENT -- the RSSI (signed byte), the number of manufacturer data entries, (company ID, length, data)
+                 for each of them, the number of service UUIDs, and the 16 bytes of each service UUID.
+                 Files of the first version only have the RSSI and the manufacturer data entries.
+POLL          -- (characteristic number, length, data) for each characteristic that was read
+NOTIFICATION  -- the characteristic number, followed by the data
+"""
+
+import os
+import time
+import uuid
+import struct
+import importlib
+
+
+_HEADER = b'TBCAP\x02'
+_HEADER_V1 = b'TBCAP\x01'
+_RECORD = struct.Struct('<dBHH')
+_MANUFACTURER_DATA = struct.Struct('<HB')
+_VALUE = struct.Struct('<BB')
+
+DEVICE = 0
+ADVERTISEMENT = 1
+POLL = 2
+NOTIFICATION = 3
+
+# Characteristics are stored as their position in the characteristics of these decoders, in this order.
+# New decoders may only be added at the end. They are imported when a capture is made or read.
+_DECODER_MODULES = ('oralb_decoder', 'sonicare_decoder')
+_UNKNOWN_CHARACTERISTIC = 255
+
+_characteristics = None
+_characteristic_numbers = None
+
+_FLUSH_INTERVAL = 5 # seconds
+
+
+
+def characteristics():
+    """All the characteristics that can be recorded, in the order they are numbered."""
+    global _characteristics, _characteristic_numbers
+    if _characteristics == None:
+        _characteristics = tuple(characteristic for module_name in _DECODER_MODULES
+                                 for characteristic in importlib.import_module('.' + module_name, __package__).ALL_CHARACTERISTICS)
+        _characteristic_numbers = {characteristic:number for number, characteristic in enumerate(_characteristics)}
+    return _characteristics
+
+
+def _characteristic_number(characteristic):
+    characteristics()
+    return _characteristic_numbers.get(characteristic, _UNKNOWN_CHARACTERISTIC)
+
+
+
+class CaptureWriter:
+    """Appends the Bluetooth traffic to a capture file."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.device_numbers = {} # address -> device number
+        self.last_flush_time = time.time()
+        self.file = open(file_path, 'wb')
+        self.file.write(_HEADER)
+
+    def _device_number(self, ble_device):
+        address = str(ble_device.address)
+        number = self.device_numbers.get(address)
+        if number == None:
+            number = len(self.device_numbers)
+            self.device_numbers[address] = number
+            name = (ble_device.name or "").encode('utf-8', 'replace')
+            self._write(time.time(), DEVICE, number, address.encode() + b'\x00' + name)
+        return number
+
+    def _write(self, record_time, kind, number, payload):
+        self.file.write(_RECORD.pack(record_time, kind, number, len(payload)))
+        self.file.write(payload)
+
+    def advertisement(self, record_time, ble_device, advertisement_data):
+        rssi = advertisement_data.rssi
+        payload = bytearray(struct.pack('<b', max(-128, min(127, rssi if rssi != None else -128))))
+        manufacturer_data = list(advertisement_data.manufacturer_data.items())[:255]
+        payload.append(len(manufacturer_data))
+        for company_id, data in manufacturer_data:
+            payload += _MANUFACTURER_DATA.pack(company_id, min(len(data), 255))
+            payload += data[:255]
+        service_uuids = list(advertisement_data.service_uuids)[:255]
+        payload.append(len(service_uuids))
+        for service_uuid in service_uuids:
+            payload += uuid.UUID(service_uuid).bytes
+        self._write(record_time, ADVERTISEMENT, self._device_number(ble_device), payload)
+
+    def poll(self, record_time, ble_device, characteristics, values):
+        payload = bytearray()
+        for characteristic, data in zip(characteristics, values):
+            payload += _VALUE.pack(_characteristic_number(characteristic), min(len(data), 255))
+            payload += data[:255]
+        self._write(record_time, POLL, self._device_number(ble_device), payload)
+
+    def notification(self, record_time, ble_device, characteristic, data):
+        payload = bytes((_characteristic_number(characteristic),)) + bytes(data)
+        self._write(record_time, NOTIFICATION, self._device_number(ble_device), payload)
+
+    def flush(self):
+        """Write what is buffered to disk, at most once every few seconds."""
+        if time.time() - self.last_flush_time > _FLUSH_INTERVAL:
+            self.last_flush_time = time.time()
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+
+def _characteristic(number):
+    return characteristics()[number] if number < len(characteristics()) else None
+
+
+def read_capture(file_path):
+    """Go over the records in a capture file, oldest first.
+
+    Yields (kind, time, address, name, value) tuples. The value of an advertisement is a tuple of the
+    RSSI, a dictionary with the manufacturer data and a list of service UUIDs. The value of a poll is a list of (characteristic,
+    data) tuples. The value of a notification is a single (characteristic, data) tuple. A partially
+    written record at the end of the file is ignored.
+    """
+    with open(file_path, 'rb') as f:
+        capture = f.read()
+    if capture.startswith(_HEADER_V1):
+        version = 1
+    elif capture.startswith(_HEADER):
+        version = 2
+    else:
+        raise ValueError("Not a toothbrush capture file: " + str(file_path))
+
+    devices = {} # device number -> (address, name)
+    position = len(_HEADER)
+    while position + _RECORD.size <= len(capture):
+        record_time, kind, number, length = _RECORD.unpack_from(capture, position)
+        position += _RECORD.size
+        payload = capture[position:position + length]
+        if len(payload) < length:
+            break
+        position += length
+
+        if kind == DEVICE:
+            address, _, name = payload.partition(b'\x00')
+            devices[number] = (address.decode(), name.decode('utf-8', 'replace'))
+            continue
+
+        address, name = devices.get(number, (None, None))
+        if kind == ADVERTISEMENT:
+            rssi = struct.unpack_from('<b', payload)[0]
+            manufacturer_data = {}
+            service_uuids = []
+            offset = 1
+            if version == 1:
+                entries = len(payload) # the manufacturer data runs to the end of the record
+            else:
+                entries = payload[offset]
+                offset += 1
+            while entries > 0 and offset + _MANUFACTURER_DATA.size <= len(payload):
+                company_id, size = _MANUFACTURER_DATA.unpack_from(payload, offset)
+                offset += _MANUFACTURER_DATA.size
+                manufacturer_data[company_id] = payload[offset:offset + size]
+                offset += size
+                entries -= 1
+            if version > 1 and offset < len(payload):
+                entries = payload[offset]
+                offset += 1
+                while entries > 0 and offset + 16 <= len(payload):
+                    service_uuids.append(str(uuid.UUID(bytes=bytes(payload[offset:offset + 16]))))
+                    offset += 16
+                    entries -= 1
+            yield kind, record_time, address, name, (rssi, manufacturer_data, service_uuids)
+
+        elif kind == POLL:
+            values = []
+            offset = 0
+            while offset + _VALUE.size <= len(payload):
+                characteristic_number, size = _VALUE.unpack_from(payload, offset)
+                offset += _VALUE.size
+                values.append((_characteristic(characteristic_number), bytearray(payload[offset:offset + size])))
+                offset += size
+            yield kind, record_time, address, name, values
+
+        elif kind == NOTIFICATION and payload:
+            yield kind, record_time, address, name, (_characteristic(payload[0]), bytearray(payload[1:]))
+
+
+
+def capture_file_path(captures_dir_path):
+    """A new capture file name, based on the current time."""
+    return os.path.join(captures_dir_path, 'capture-' + time.strftime('%Y%m%d-%H%M%S') + '.tbcap')
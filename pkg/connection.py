@@ -0,0 +1,387 @@
+"""The connection to a single toothbrush, and what is common to the drivers of all brands.
+
+A driver subclasses ToothbrushConnection, and sets the brand and the decoder module of that brand.
+The decoder provides the GATT characteristics to read and subscribe to, and how to decode them.
+"""
+
+from __future__ import annotations
+
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from .metrics import DeviceMetrics
+
+if TYPE_CHECKING:
+    from bleak import BleakClient
+    from bleak.backends.device import BLEDevice
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+_CONNECTION_SLOT_TIMEOUT = 10 # seconds to wait for a free connection slot
+_ADVERTISEMENT_FRESHNESS = 10 # seconds. Without a newer advertisement the toothbrush is polled over GATT again.
+_BATTERY_POLL_INTERVAL = 600 # seconds
+
+# The states of the connection property
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+
+UNKNOWN = "UNKNOWN" # what the decoders of all brands make of a byte value they don't know
+
+
+
+class ToothbrushData:
+    """The latest known state of a toothbrush. The decoders of all brands write into one of these."""
+
+    __slots__ = ('brush_time', 'battery', 'status', 'mode', 'sector', 'sector_time', 'pressure', 'pressure_state')
+
+    def __init__(self):
+        self.brush_time = None
+        self.battery = None
+        self.status = None
+        self.mode = None
+        self.sector = None
+        self.sector_time = None
+        self.pressure = None
+        self.pressure_state = None
+
+    def as_dict(self):
+        return {name:getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+
+
+def byte_table(values, default=UNKNOWN):
+    """Turn a dictionary into a tuple with an entry for every possible byte value, for the decoders."""
+    return tuple(values.get(index, default) for index in range(256))
+
+
+
+class Advertisement:
+    """Takes the place of bleak's AdvertisementData, for the backends that don't use bleak."""
+
+    __slots__ = ('local_name', 'manufacturer_data', 'service_data', 'service_uuids', 'rssi')
+
+    def __init__(self, local_name, manufacturer_data, rssi, service_uuids=None):
+        self.local_name = local_name
+        self.manufacturer_data = manufacturer_data
+        self.service_data = {}
+        self.service_uuids = service_uuids if service_uuids != None else []
+        self.rssi = rssi
+
+
+
+class Characteristic:
+    def __init__(self, uuid, handle, properties):
+        self.uuid = uuid
+        self.handle = handle
+        self.properties = properties
+
+
+
+class Service:
+    def __init__(self, uuid, handle, characteristics):
+        self.uuid = uuid
+        self.handle = handle
+        self.characteristics = characteristics
+
+
+
+class ToothbrushConnection:
+    """Connects to a toothbrush to get information. The driver of each brand fills in the brand and its decoder."""
+
+    brand = None
+    decoder = None # the module with the characteristics and decoders of the brand
+
+    def __init__(self, ble_device: BLEDevice, controllers=None, metrics=None, backend=None) -> None:
+        """Initialize the class object."""
+        self.ble_device = ble_device
+        self.controllers = controllers
+        self.controller = None # the controller that holds the connection slot
+        self.sightings = {} # controller name -> the last ble_device, rssi and time it picked up
+        self.metrics = metrics if metrics != None else DeviceMetrics()
+        if backend == None:
+            from .ble_backend import BleakBackend
+            backend = BleakBackend()
+        self.backend = backend
+        self.capture = None # records the GATT traffic, if the adapter is recording
+        self.connection_lost = False
+        self.last_poll_succeeded = False
+        self.suspended = False
+        self.parked_until = None # while disconnected because of being idle: the earliest time to connect again
+        self.last_active_time = 0
+        self.connection_state = DISCONNECTED
+        self.connection_state_callback = None
+        self.wake_event = asyncio.Event()
+        self._cached_services = None
+        self.client = None
+        self.name = self.__class__.__name__
+        # Each toothbrush gets its own budget in the rate limited log
+        self.logger = logging.LoggerAdapter(_LOGGER, {'device':getattr(ble_device, 'address', None)})
+        self.prev_time = 0
+        self.last_advertisement_time = 0
+        self.last_battery_time = 0
+        self.notifying = False
+
+        self.result = ToothbrushData() # all brands report their state in the same form
+
+    def set_ble_device(self, ble_device, controller=None, rssi=None, seen_time=None) -> None:
+        """Remember the device from the latest advertisement, and how well each controller receives it."""
+        self.ble_device = ble_device
+        if seen_time != None:
+            self.sightings[controller] = (ble_device, rssi, seen_time)
+
+    async def disconnect(self) -> None:
+        """Stop the notifications and disconnect. Polling will connect again when needed."""
+        await self.stop_notifications()
+        await self.release_connection()
+
+    def is_connected(self) -> bool:
+        return self.client != None and self.client.is_connected
+
+    def idle_time(self) -> float:
+        """Seconds since the toothbrush was last used, or since the connection was made."""
+        return time.time() - self.last_active_time
+
+    def _set_connection_state(self, state) -> None:
+        if state != self.connection_state:
+            self.connection_state = state
+            if self.connection_state_callback != None:
+                self.connection_state_callback(state)
+
+    async def connect(self) -> None:
+        """Ensure connection to device is established."""
+        if self.client and self.client.is_connected:
+            return
+
+        # Check again while holding the lock
+        if self.client and self.client.is_connected:
+            return
+        ble_device = self.ble_device
+        controller_name = None
+        if self.controllers != None and self.controller == None:
+            sightings = {name:(rssi, seen_time) for name, (_ble_device, rssi, seen_time) in self.sightings.items()}
+            self.controller = await self.controllers.acquire(sightings, _CONNECTION_SLOT_TIMEOUT)
+            if self.controller == None:
+                self.logger.debug("%s: No free connection slot", self.name)
+                return
+        if self.controller != None:
+            # Connect through the controller, using the device as that controller saw it
+            controller_name = self.controller.name
+            if controller_name in self.sightings:
+                ble_device = self.sightings[controller_name][0]
+        self.logger.debug("%s: Connecting through controller %s; RSSI: %s", self.name, self.controller, ble_device.rssi)
+        
+        connect_start = time.perf_counter()
+        self._set_connection_state(CONNECTING)
+        try:
+            self.client = await self.backend.connect(
+                ble_device,
+                self.name,
+                self._disconnected,
+                cached_services=self._cached_services,
+                ble_device_callback=lambda: ble_device,
+                use_services_cache=True, # BlueZ keeps the services of earlier connections, also across restarts
+                controller=controller_name,
+            )
+            self.logger.debug("%s: Connected; RSSI: %s", self.name, ble_device.rssi)
+            if self.controller != None:
+                self.controllers.connected(self.controller)
+            self.last_active_time = time.time()
+            self._set_connection_state(CONNECTED)
+            self.metrics.observe('connect', time.perf_counter() - connect_start)
+            self.metrics.increment('connects')
+            if self._cached_services != None:
+                self.metrics.increment('cached_connects')
+            self._cached_services = self.client.services
+            if self.connection_lost:
+                self.connection_lost = False
+                self.metrics.increment('reconnects')
+        except Exception as ex:
+            self.logger.info("%s: Error connecting to device: %s", self.name, ex)
+            self.metrics.increment('connect_failures')
+            self.metrics.last_error = "connect: " + str(ex)
+            if self.controller != None:
+                self.controllers.connect_failed(self.controller)
+            self._set_connection_state(DISCONNECTED)
+            self._release_connection_slot()
+
+    async def forget_services(self) -> None:
+        """The cached services may be out of date, so discover them again on the next connection."""
+        self._cached_services = None
+        if self.client != None:
+            await self.backend.clear_cache(self.client)
+            await self.release_connection()
+
+    def _release_connection_slot(self) -> None:
+        if self.controller != None:
+            controller = self.controller
+            self.controller = None
+            self.controllers.release(controller)
+
+    async def release_connection(self) -> None:
+        """Disconnect, so that another toothbrush can use the connection slot."""
+        client = self.client
+        self.client = None
+        self.notifying = False
+        if client:
+            try:
+                await client.disconnect()
+            except Exception as ex:
+                self.logger.debug("%s: Error disconnecting: %s", self.name, ex)
+        self._set_connection_state(DISCONNECTED)
+        self._release_connection_slot()
+
+    def _disconnected(self, client: BleakClient) -> None:
+        """Disconnected callback."""
+        self.logger.info("%s: Disconnected from device", self.name)
+        if self.client != None:
+            # release_connection clears the client first, so this disconnect was not planned
+            self.connection_lost = True
+            self.metrics.increment('disconnects')
+        self.client = None
+        self.notifying = False
+        self._set_connection_state(DISCONNECTED)
+        self._release_connection_slot()
+
+    async def start_notifications(self, callback) -> bool:
+        """Subscribe to the characteristics that change during a brushing session.
+        
+        callback -- called with self.result every time a notification has been decoded
+        """
+        if self.notifying:
+            return True
+        await self.connect()
+        if not self.client:
+            return False
+        
+        try:
+            for char in self.decoder.NOTIFY_CHARACTERISTICS:
+                await self.client.start_notify(char, self._notification_handler(char, callback))
+            self.notifying = True
+        except Exception as ex:
+            self.logger.warning("%s: could not start notifications: %s", self.name, ex)
+            await self.stop_notifications()
+        
+        return self.notifying
+
+    async def stop_notifications(self) -> None:
+        """Unsubscribe from the characteristics again, so that polling can take over."""
+        self.notifying = False
+        if not self.client:
+            return
+        for char in self.decoder.NOTIFY_CHARACTERISTICS:
+            try:
+                await self.client.stop_notify(char)
+            except Exception as ex:
+                self.logger.debug("%s: Error stopping notifications: %s", self.name, ex)
+
+    def decode_characteristic(self, char, data):
+        """Decode the value of a single GATT characteristic into the latest data."""
+        self.decoder.DECODERS[char](self.result, data)
+
+    def _notification_handler(self, char, callback):
+        """Create the handler for notifications from a single characteristic."""
+        decode = self.decoder.DECODERS[char]
+        def handler(sender, data: bytearray) -> None:
+            try:
+                self.metrics.increment('notifications')
+                self.metrics.record_sample()
+                if self.capture != None:
+                    self.capture.notification(time.time(), self.ble_device, char, data)
+                decode(self.result, data)
+                callback(self.result)
+            except Exception as ex:
+                self.logger.warning("%s: caught error handling %s notification: %s", self.name, char, ex)
+        return handler
+
+    def wake(self) -> None:
+        """Make the polling task poll this toothbrush right away."""
+        self.wake_event.set()
+
+    async def sleep(self, delay) -> None:
+        """Wait until the next poll is due, or until something wakes this toothbrush up.
+        
+        delay -- seconds to wait, or None to wait until woken up
+        """
+        try:
+            if delay == None:
+                await self.wake_event.wait()
+            else:
+                await asyncio.wait_for(self.wake_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        self.wake_event.clear()
+
+    def advertisement_is_fresh(self) -> bool:
+        """Whether a recent advertisement has already provided the brushing data."""
+        return time.time() - self.last_advertisement_time < _ADVERTISEMENT_FRESHNESS
+
+    def battery_poll_is_due(self) -> bool:
+        """The battery level is not advertised, so it still has to be read over GATT once in a while."""
+        return self.result.battery == None or time.time() - self.last_battery_time > _BATTERY_POLL_INTERVAL
+
+    def parse_advertisement(self, data) -> bool:
+        """Decode the manufacturer specific data that the toothbrush broadcasts."""
+        if not self.decoder.decode_advertisement(self.result, data):
+            return False
+        self.last_advertisement_time = time.time()
+        return True
+
+    async def gatherdata(self, characteristics=None):
+        """Connect to the toothbrush to get data.
+        
+        characteristics -- the characteristics to read. By default all of them are read.
+        Returns None if nothing was read, so that the previous data isn't applied again.
+        """
+        if characteristics == None:
+            characteristics = self.decoder.ALL_CHARACTERISTICS
+        if self.ble_device is None:
+            #print("gatherdata: self.ble_device is None, aborting")
+            return None
+        if time.time() - self.prev_time < 1:
+            #print("gatherdata: already scanned less than a second ago, aborting")
+            return None
+        self.prev_time = time.time()
+        self.last_poll_succeeded = False
+        #print("gatherdata: trying to connect...")
+        await self.connect()
+        #print("gatherdata: connected!")
+       
+        try:
+            if self.client:
+                read_start = time.perf_counter()
+                results = await asyncio.gather(*[self.client.read_gatt_char(char) for char in characteristics])
+                #print("gatherdata: all tasks complete!")
+                decode_start = time.perf_counter()
+                self.metrics.observe('read', decode_start - read_start)
+                self.metrics.increment('reads', len(characteristics))
+                self.metrics.record_sample()
+                if self.capture != None:
+                    self.capture.poll(time.time(), self.ble_device, characteristics, results)
+
+                for char, data in zip(characteristics, results):
+                    self.decode_characteristic(char, data)
+                self.metrics.observe('decode', time.perf_counter() - decode_start)
+                if self.decoder.BATTERY_CHARACTERISTIC in characteristics:
+                    self.last_battery_time = time.time()
+                self.last_poll_succeeded = True
+            
+        except Exception as ex:
+            self.logger.info("%s: Not connected to device: %s", self.name, ex)
+            if self.client:
+                self.metrics.increment('read_failures')
+                self.metrics.last_error = "read: " + str(ex)
+                await self.forget_services()
+        
+        #print("result: ", self.result)
+
+        return self.result
+
+
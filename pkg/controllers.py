@@ -0,0 +1,180 @@
+"""The Bluetooth controllers (hci0, hci1, ...) the Toothbrush adapter spreads its toothbrushes over.
+
+A single controller can only hold a few connections at once. With several controllers the adapter
+scans on all of them, and every time a toothbrush needs a connection it is placed on the controller
+that hears it best and still has room. A controller that stops working is left alone for a while,
+so that its toothbrushes connect through the others instead.
+"""
+
+import re
+import time
+import asyncio
+
+
+_SIGHTING_MAX_AGE = 60 # seconds. Only recent advertisements say anything about which controller hears a toothbrush best.
+_FREE_SLOT_BONUS = 3 # dB of signal strength that every free connection slot on a controller is worth
+_UNKNOWN_RSSI = -127 # for a controller that has not heard the toothbrush recently
+_FAILURE_LIMIT = 3 # failed connections in a row before a controller is considered to be broken
+_FAILED_CONTROLLER_RETRY = 60 # seconds before a broken controller is tried again
+
+_CONTROLLER_NAME = re.compile(r'^hci[0-9]+$')
+
+
+
+def parse_controller_names(value):
+    """Turn the comma separated 'Bluetooth controllers' setting into a list of names, skipping invalid ones."""
+    names = []
+    for name in str(value).replace(' ', ',').split(','):
+        name = name.strip().lower()
+        if name == '':
+            continue
+        if not _CONTROLLER_NAME.match(name):
+            print("Ignoring invalid Bluetooth controller name: " + name)
+            continue
+        if not name in names:
+            names.append(name)
+    return names
+
+
+
+class Controller:
+    """A single Bluetooth controller, and the connections that are using it."""
+
+    def __init__(self, name, size):
+        self.name = name # None for the default controller
+        self.size = size
+        self.connections = 0
+        self.failures = 0 # failed connections in a row
+        self.failed_until = 0
+
+    def __repr__(self):
+        return self.name or 'default'
+
+    def free_slots(self):
+        return self.size - self.connections
+
+    def working(self, now=None):
+        return (now if now != None else time.time()) >= self.failed_until
+
+
+
+class ControllerSet:
+    """Hands out connection slots on the controllers, and limits how many toothbrushes are connected to each one."""
+
+    def __init__(self, names, size):
+        self.controllers = [Controller(name, size) for name in (names or [None])]
+        self.by_name = {controller.name:controller for controller in self.controllers}
+        self.waiting = 0
+        self.changed = asyncio.Event() # replaced by a fresh event every time a slot frees up
+
+
+    def names(self):
+        return list(self.by_name)
+
+
+    def add(self, name, size):
+        """Add a controller that came online later, such as a remote proxy. A known controller is put back into rotation."""
+        controller = self.by_name.get(name)
+        if controller == None:
+            controller = Controller(name, size)
+            self.controllers.append(controller)
+            self.by_name[name] = controller
+        controller.failures = 0
+        controller.failed_until = 0
+        self._notify()
+
+
+    def choose(self, sightings, now=None):
+        """Pick the controller for a connection, or None if none has a free slot.
+
+        sightings -- controller name -> (rssi, time) of the last advertisement of the toothbrush it picked up
+        """
+        now = now if now != None else time.time()
+        
+        # A toothbrush can only be connected through a controller that has picked up its advertisements,
+        # preferably lately. Only a toothbrush that hasn't been seen yet can be tried on any of them.
+        heard = {name:sighting[0] for name, sighting in sightings.items()
+                 if name in self.by_name and self.by_name[name].working(now) and now - sighting[1] < _SIGHTING_MAX_AGE}
+        if not heard:
+            heard = {name:None for name in sightings if name in self.by_name and self.by_name[name].working(now)}
+        
+        best = None
+        best_score = None
+        for controller in self.controllers:
+            if controller.free_slots() <= 0 or not controller.working(now):
+                continue
+            if sightings and not controller.name in heard:
+                continue
+            rssi = heard.get(controller.name)
+            score = (rssi if rssi != None else _UNKNOWN_RSSI) + _FREE_SLOT_BONUS * controller.free_slots()
+            if best_score == None or score > best_score:
+                best = controller
+                best_score = score
+        return best
+
+
+    async def acquire(self, sightings, timeout):
+        """Wait for a free slot on a suitable controller. Returns the controller, or None if none became available in time."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.waiting += 1
+        try:
+            while True:
+                controller = self.choose(sightings)
+                if controller != None:
+                    controller.connections += 1
+                    return controller
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(self.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+        finally:
+            self.waiting -= 1
+
+
+    def release(self, controller):
+        controller.connections -= 1
+        self._notify()
+
+
+    def connected(self, controller):
+        controller.failures = 0
+
+
+    def connect_failed(self, controller):
+        """Count a failed connection. After several in a row the controller is skipped for a while."""
+        controller.failures += 1
+        if controller.failures >= _FAILURE_LIMIT:
+            self.fail(controller.name)
+
+
+    def fail(self, name):
+        """A controller stopped working. Toothbrushes are placed on the other controllers until it is retried."""
+        controller = self.by_name.get(name)
+        if controller == None or len(self.controllers) == 1:
+            return # with a single controller there is nowhere else to go
+        if controller.working():
+            print("Bluetooth controller " + str(controller) + " is not working, moving its toothbrushes to the other controllers")
+        controller.failures = 0
+        controller.failed_until = time.time() + _FAILED_CONTROLLER_RETRY
+        self._notify()
+
+
+    def _notify(self):
+        # Wake up every toothbrush that is waiting for a slot, so it can check again
+        changed = self.changed
+        self.changed = asyncio.Event()
+        changed.set()
+
+
+    def snapshot(self):
+        """The load of every controller, for the metrics."""
+        now = time.time()
+        return {str(controller):{
+            'connections':controller.connections,
+            'slots':controller.size,
+            'working':controller.working(now),
+        } for controller in self.controllers}
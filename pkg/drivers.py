@@ -0,0 +1,70 @@
+"""The brands of toothbrushes the adapter supports, and how to recognise them.
+
+Every brand has a driver: a ToothbrushConnection subclass in a module of its own. This registry only
+holds what the advertisements of each brand look like. A driver module is imported the first time a
+toothbrush of its brand shows up, so brands that are not in use cost nothing.
+
+Advertisements are matched through indexes of manufacturer IDs, service UUIDs and names. That takes
+a lookup per field of the advertisement, however many brands there are.
+"""
+
+import importlib
+
+
+
+class Driver:
+    """The signature of a brand, and where to find its driver."""
+
+    def __init__(self, brand, module_name, class_name, manufacturer_ids=(), service_uuids=(), names=()):
+        self.brand = brand
+        self.module_name = module_name
+        self.class_name = class_name
+        self.manufacturer_ids = manufacturer_ids
+        self.service_uuids = service_uuids
+        self.names = names # only a last resort, as names can be missing or changed
+        self.connection_class = None
+
+    def __repr__(self):
+        return self.brand
+
+    def load(self):
+        """Get the driver class, importing its module if that hasn't happened yet."""
+        if self.connection_class == None:
+            module = importlib.import_module('.' + self.module_name, __package__)
+            self.connection_class = getattr(module, self.class_name)
+        return self.connection_class
+
+
+
+DRIVERS = (
+    Driver('oralb', 'oralb', 'OralB',
+           manufacturer_ids=(0x00DC,), # Procter & Gamble
+           service_uuids=("a0f0fff0-5047-4d53-8208-4f72616c2d42",),
+           names=("Oral-B Toothbrush",)),
+    Driver('sonicare', 'sonicare', 'Sonicare',
+           service_uuids=("477ea600-a260-11e4-ae37-0002a5d50001",),
+           names=("Philips Sonicare",)),
+)
+
+BRANDS = {driver.brand:driver for driver in DRIVERS}
+_BY_MANUFACTURER_ID = {manufacturer_id:driver for driver in DRIVERS for manufacturer_id in driver.manufacturer_ids}
+_BY_SERVICE_UUID = {service_uuid:driver for driver in DRIVERS for service_uuid in driver.service_uuids}
+_BY_NAME = {name:driver for driver in DRIVERS for name in driver.names}
+
+# For scan filters
+MANUFACTURER_IDS = tuple(_BY_MANUFACTURER_ID)
+SERVICE_UUIDS = tuple(_BY_SERVICE_UUID)
+
+
+
+def match(name, manufacturer_data, service_uuids):
+    """Get the driver for an advertisement, or None if it doesn't come from a supported toothbrush."""
+    for manufacturer_id in manufacturer_data:
+        driver = _BY_MANUFACTURER_ID.get(manufacturer_id)
+        if driver != None:
+            return driver
+    for service_uuid in service_uuids:
+        driver = _BY_SERVICE_UUID.get(service_uuid)
+        if driver != None:
+            return driver
+    return _BY_NAME.get(name)
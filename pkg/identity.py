@@ -0,0 +1,97 @@
+"""Identities of the toothbrushes the adapter knows about.
+
+Every toothbrush thing has an id that is derived from a hash of the Bluetooth address it was first
+seen with. The index maps addresses to thing ids and back, so that an advertisement can be matched
+to its thing with a single dictionary lookup, and so that a thing can keep its id if its toothbrush
+later shows up with a different address.
+"""
+
+import hashlib
+
+
+_ID_PREFIX = 'toothbrush_'
+_ID_HASH_LENGTH = 6 # hex characters of the address hash in a thing id
+
+
+
+def normalise_address(address):
+    return str(address).upper()
+
+
+
+class IdentityIndex:
+    """Maps Bluetooth addresses to toothbrush thing ids, and thing ids to addresses.
+
+    The index is built once from the toothbrush records in the persistent data, and keeps the
+    'address' of those records up to date when an address changes.
+    """
+
+    def __init__(self, records):
+        self.records = records # toothbrush_thing_id -> persistent record
+        self.thing_ids = {} # address -> toothbrush_thing_id
+        self.addresses = {} # toothbrush_thing_id -> address
+        self.duplicates = [] # ids of records for an address that already belonged to another thing
+
+        # If an address ended up with several things, the oldest one is the real one
+        for toothbrush_thing_id, record in sorted(records.items(), key=lambda item: item[1].get('first_seen') or 0):
+            address = record.get('address')
+            if not address:
+                continue
+            address = normalise_address(address)
+            if address in self.thing_ids:
+                self.duplicates.append(toothbrush_thing_id)
+                continue
+            self.thing_ids[address] = toothbrush_thing_id
+            self.addresses[toothbrush_thing_id] = address
+
+
+    def thing_id(self, address):
+        """Get the id of the thing that belongs to an address, or None if the address is unknown."""
+        return self.thing_ids.get(address)
+
+
+    def address(self, toothbrush_thing_id):
+        return self.addresses.get(toothbrush_thing_id)
+
+
+    def new_thing_id(self, address):
+        """Create a stable id for a toothbrush that was found at an address. Returns the id and the full hash.
+
+        The id only depends on the address. In the unlikely case that it is already taken by another
+        toothbrush, more of the hash is used.
+        """
+        unique_hash = hashlib.sha256(normalise_address(address).encode()).hexdigest()
+        length = _ID_HASH_LENGTH
+        toothbrush_thing_id = _ID_PREFIX + unique_hash[-length:]
+        while (toothbrush_thing_id in self.addresses or toothbrush_thing_id in self.records) and length < len(unique_hash):
+            length += 2
+            toothbrush_thing_id = _ID_PREFIX + unique_hash[-length:]
+        return toothbrush_thing_id, unique_hash
+
+
+    def add(self, toothbrush_thing_id, address):
+        address = normalise_address(address)
+        self.thing_ids[address] = toothbrush_thing_id
+        self.addresses[toothbrush_thing_id] = address
+
+
+    def move(self, toothbrush_thing_id, address):
+        """A known toothbrush now uses a different address, for example because it was re-paired."""
+        self.remove(toothbrush_thing_id)
+        self.add(toothbrush_thing_id, address)
+        if toothbrush_thing_id in self.records:
+            self.records[toothbrush_thing_id]['address'] = normalise_address(address)
+
+
+    def remove(self, toothbrush_thing_id):
+        address = self.addresses.pop(toothbrush_thing_id, None)
+        if address != None and self.thing_ids.get(address) == toothbrush_thing_id:
+            del self.thing_ids[address]
+
+
+    def unseen(self, seen_addresses, name, brand):
+        """Get the ids of the known toothbrushes with this name and brand whose address has not been seen."""
+        return [toothbrush_thing_id for toothbrush_thing_id, address in self.addresses.items()
+                if not address in seen_addresses
+                and self.records.get(toothbrush_thing_id, {}).get('name') == name
+                and self.records.get(toothbrush_thing_id, {}).get('brand') == brand]
@@ -0,0 +1,128 @@
+"""Logging for the Toothbrush adapter.
+
+Log records are handed to a background thread that writes them out, so logging never blocks the
+Bluetooth event loop. Messages that repeat quickly are rate limited, and the most recent events are
+kept in memory so they can be dumped to a file when something needs to be diagnosed.
+"""
+
+import sys
+import time
+import queue
+import logging
+import logging.handlers
+import collections
+
+
+_LOGGER_NAME = 'pkg' # the parent of the loggers in all the modules of this add-on
+_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_RATE_LIMIT_INTERVAL = 10 # seconds
+_RATE_LIMIT_BURST = 3 # identical messages allowed per interval
+_RING_BUFFER_SIZE = 1000 # events
+
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets only a few identical messages through per interval, and reports how many were dropped.
+
+    Messages about a single toothbrush can pass extra={'device': ...}, so that every toothbrush gets
+    a budget of its own, and the errors of one toothbrush can't hide those of another.
+    """
+
+    def __init__(self, interval=_RATE_LIMIT_INTERVAL, burst=_RATE_LIMIT_BURST):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {} # (logger, level, message, device) -> [window start, messages let through, messages suppressed]
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg, getattr(record, 'device', None))
+        window = self.windows.get(key)
+
+        if window == None or record.created - window[0] >= self.interval:
+            if window != None and window[2]:
+                record.msg = str(record.msg) + " (" + str(window[2]) + " similar messages were suppressed)"
+            self.windows[key] = [record.created, 1, 0]
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        return False
+
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent log events in memory."""
+
+    def __init__(self, size=_RING_BUFFER_SIZE):
+        super().__init__()
+        self.events = collections.deque(maxlen=size)
+
+    def emit(self, record):
+        try:
+            # The message is rendered now, as the arguments may be objects that change later
+            self.events.append((record.created, record.levelname, record.name, record.getMessage()))
+        except Exception as ex:
+            self.events.append((record.created, record.levelname, record.name, "could not format log message: " + str(ex)))
+
+    def lines(self):
+        return [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)) + " " + levelname + " " + name + ": " + message for created, levelname, name, message in list(self.events)]
+
+
+
+class LogSystem:
+    """Sets up the loggers of the add-on."""
+
+    def __init__(self, debug=False):
+        self.logger = logging.getLogger(_LOGGER_NAME)
+        self.logger.propagate = False
+
+        self.ring_buffer = RingBufferHandler()
+
+        # The writer thread
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.addFilter(RateLimitFilter())
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(_FORMAT))
+        self.listener = logging.handlers.QueueListener(self.queue, stream_handler)
+        self.listener.start()
+        self.closed = False
+
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.ring_buffer)
+        self.logger.addHandler(self.queue_handler)
+
+        self.set_debug(debug)
+
+
+    def set_debug(self, debug):
+        """Debug messages are only logged (and kept in the ring buffer) if the Debugging option is enabled."""
+        self.logger.setLevel(logging.DEBUG if debug else logging.INFO)
+
+
+    def dump(self, file_path):
+        """Write the recent events to a file."""
+        try:
+            with open(file_path, 'w') as f:
+                f.write("Recent events of the toothbrush add-on, dumped at " + time.strftime('%Y-%m-%d %H:%M:%S') + "\n")
+                f.write("\n".join(self.ring_buffer.lines()) + "\n")
+            return True
+        except Exception as ex:
+            print("Error: could not dump recent events: " + str(ex))
+            return False
+
+
+    def close(self):
+        """Write out anything that is still queued. Closing more than once does nothing."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.listener.stop()
+        except Exception as ex:
+            print("Error: could not stop log writer: " + str(ex))
@@ -0,0 +1,181 @@
+"""Performance metrics for the Toothbrush adapter.
+
+Every toothbrush gets counters and latency histograms for its scans, connections, reads and
+property updates. A snapshot of all of them is written to metrics.json in the data directory
+once a minute, which shows why the updates of a toothbrush lag, and how many toothbrushes a
+single gateway can keep up with.
+"""
+
+import os
+import json
+import time
+
+
+# Upper bounds of the latency histogram buckets, in seconds. Anything slower ends up in the last bucket.
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+COUNTERS = (
+    'detections',       # advertisements picked up by the scanner
+    'connects',         # successful connections
+    'cached_connects',  # successful connections that reused the services of the previous connection
+    'connect_failures',
+    'reconnects',       # connections made after the previous one was lost unexpectedly
+    'disconnects',      # connections that were lost unexpectedly
+    'reads',            # GATT characteristics that were read
+    'read_failures',
+    'notifications',    # GATT notifications that were received
+    'updates',          # property updates that were sent to the controller
+)
+
+HISTOGRAMS = (
+    'connect',          # establish_connection
+    'read',             # reading all the requested characteristics of one poll
+    'decode',           # decoding the data of one poll, notification or advertisement
+    'notify',           # sending the changed properties to the controller
+    'end_to_end',       # from receiving the data over the radio to sending the properties to the controller
+)
+
+
+
+class LatencyHistogram:
+    """Counts durations in fixed buckets, so that recording one is cheap and the memory use never grows."""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(_BUCKETS) and seconds > _BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the durations of another histogram to this one."""
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """Estimate a percentile as the upper bound of the bucket it falls in."""
+        if self.count == 0:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return min(_BUCKETS[index], self.max) if index < len(_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count':self.count,
+            'average':round(self.total / self.count, 4) if self.count else None,
+            'p50':self.percentile(0.5),
+            'p95':self.percentile(0.95),
+            'max':round(self.max, 4),
+            'buckets':{('<=' + str(bound)):count for bound, count in zip(_BUCKETS, self.counts) if count},
+            'slower':self.counts[-1],
+        }
+
+
+
+class DeviceMetrics:
+    """The metrics of a single toothbrush."""
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {name:LatencyHistogram() for name in HISTOGRAMS}
+        self.rssi = None
+        self.min_rssi = None
+        self.max_rssi = None
+        self.last_error = None
+        self.sample_time = None # when the radio data that is currently being handled arrived
+
+    def increment(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, seconds):
+        self.histograms[name].observe(seconds)
+
+    def record_rssi(self, rssi):
+        if rssi == None:
+            return
+        self.rssi = rssi
+        if self.min_rssi == None or rssi < self.min_rssi:
+            self.min_rssi = rssi
+        if self.max_rssi == None or rssi > self.max_rssi:
+            self.max_rssi = rssi
+
+    def record_sample(self, sample_time=None):
+        """Remember when the data that is about to be applied to the properties was received."""
+        self.sample_time = time.time() if sample_time == None else sample_time
+
+    def sample_handled(self):
+        """The properties have been updated with the latest sample."""
+        if self.sample_time != None:
+            self.observe('end_to_end', max(0, time.time() - self.sample_time))
+            self.sample_time = None
+
+    def to_dict(self):
+        return {
+            'counters':dict(self.counters),
+            'latency':{name:histogram.to_dict() for name, histogram in self.histograms.items()},
+            'rssi':{'last':self.rssi, 'min':self.min_rssi, 'max':self.max_rssi},
+            'last_error':self.last_error,
+        }
+
+
+
+class MetricsRegistry:
+    """Holds the metrics of all toothbrushes, and writes snapshots of them to disk."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.temporary_file_path = file_path + '.tmp'
+        self.started = time.time()
+        self.devices = {} # toothbrush_thing_id -> DeviceMetrics
+
+    def device(self, toothbrush_thing_id):
+        """Get the metrics of a toothbrush, creating them if they don't exist yet."""
+        metrics = self.devices.get(toothbrush_thing_id)
+        if metrics == None:
+            metrics = DeviceMetrics()
+            self.devices[toothbrush_thing_id] = metrics
+        return metrics
+
+    def snapshot(self, extra=None):
+        """Build a JSON-serialisable copy of all the metrics.
+
+        extra -- gateway wide values to add, such as the number of connection slots in use
+        """
+        snapshot = {
+            'time':int(time.time()),
+            'uptime':int(time.time() - self.started),
+            'toothbrushes':{toothbrush_thing_id:metrics.to_dict() for toothbrush_thing_id, metrics in list(self.devices.items())},
+        }
+        if extra:
+            snapshot.update(extra)
+        return snapshot
+
+    def write(self, snapshot):
+        """Write a snapshot to disk. A half written file is never left behind."""
+        try:
+            with open(self.temporary_file_path, 'w') as f:
+                json.dump(snapshot, f, indent=1)
+            os.replace(self.temporary_file_path, self.file_path)
+            return True
+        except Exception as ex:
+            print("Error: could not write metrics: " + str(ex))
+            return False
@@ -0,0 +1,44 @@
+"""Lets the Toothbrush adapter run without a gateway, for the benchmark and the replay tool."""
+
+from gateway_addon import Adapter
+
+
+
+class GatewayStandIn:
+    """Takes the place of the add-on manager proxy, and counts what the adapter sends to the gateway."""
+
+    def __init__(self):
+        self.property_changes = 0
+        self.listener = None # if set, called with every property that changed
+
+    def send_property_changed_notification(self, prop):
+        self.property_changes += 1
+        if self.listener != None:
+            self.listener(prop)
+
+    def send_connected_notification(self, device, connected):
+        pass
+
+    def handle_device_added(self, device):
+        pass
+
+    def handle_device_removed(self, device):
+        pass
+
+
+
+class OfflineAdapter(Adapter):
+    """Sets up what the gateway_addon Adapter would, without connecting to a gateway.
+
+    Put it after the adapter in the bases of a subclass, and set offline_dir_path before initialising.
+    """
+
+    def __init__(self, _id, package_name, verbose=False):
+        self.id = _id
+        self.package_name = package_name
+        self.verbose = verbose
+        self.devices = {}
+        self.actions = {}
+        self.manager_proxy = GatewayStandIn()
+        self.user_profile = {'addonsDir':self.offline_dir_path, 'dataDir':self.offline_dir_path}
+        self.preferences = {}
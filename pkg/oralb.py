@@ -0,0 +1,12 @@
+"""Driver for Oral-B toothbrushes."""
+
+from .connection import ToothbrushConnection
+from . import oralb_decoder
+
+
+
+class OralB(ToothbrushConnection):
+    """Connects to OralB toothbrush to get information."""
+
+    brand = 'oralb'
+    decoder = oralb_decoder
@@ -0,0 +1,180 @@
+"""Decoder for the data that Oral-B toothbrushes send, both over GATT and in their advertisements.
+
+All lookup tables are built once, as tuples that can be indexed directly with a byte value, and the
+decoders write straight into a reusable ToothbrushData object.
+"""
+
+from .drivers import BRANDS
+from .connection import byte_table
+
+
+# How Oral-B toothbrushes advertise themselves, as registered with the drivers
+MANUFACTURER_ID = BRANDS['oralb'].manufacturer_ids[0] # Procter & Gamble
+SERVICE_UUID = BRANDS['oralb'].service_uuids[0]
+DEVICE_NAME = BRANDS['oralb'].names[0]
+
+STATUS_CHARACTERISTIC = "a0f0ff04-5047-4d53-8208-4f72616c2d42"
+BATTERY_CHARACTERISTIC = "a0f0ff05-5047-4d53-8208-4f72616c2d42"
+MODE_CHARACTERISTIC = "a0f0ff07-5047-4d53-8208-4f72616c2d42"
+TIME_CHARACTERISTIC = "a0f0ff08-5047-4d53-8208-4f72616c2d42"
+SECTOR_CHARACTERISTIC = "a0f0ff09-5047-4d53-8208-4f72616c2d42"
+PRESSURE_CHARACTERISTIC = "a0f0ff0b-5047-4d53-8208-4f72616c2d42"
+
+# The characteristics that are read during a normal poll
+ALL_CHARACTERISTICS = (
+    TIME_CHARACTERISTIC,
+    BATTERY_CHARACTERISTIC,
+    STATUS_CHARACTERISTIC,
+    MODE_CHARACTERISTIC,
+    SECTOR_CHARACTERISTIC,
+    PRESSURE_CHARACTERISTIC,
+)
+BATTERY_CHARACTERISTICS = (BATTERY_CHARACTERISTIC,)
+
+# The characteristics that change during a brushing session
+NOTIFY_CHARACTERISTICS = (
+    TIME_CHARACTERISTIC,
+    SECTOR_CHARACTERISTIC,
+    PRESSURE_CHARACTERISTIC,
+    STATUS_CHARACTERISTIC,
+)
+
+# Numeric pressure values, as used by the pressure property
+LOW_PRESSURE = 0
+NORMAL_PRESSURE = 1
+HIGH_PRESSURE = 2
+
+
+
+STATUSES = byte_table({
+    2: "IDLE",
+    3: "RUN",
+})
+
+MODES = byte_table({
+    0: "OFF",
+    1: "DAILY_CLEAN",
+    7: "INTENSE",
+    2: "SENSITIVE",
+    4: "WHITEN",
+    3: "GUM_CARE",
+    6: "TONGUE_CLEAN",
+})
+
+# Sector numbering in the GATT characteristic
+SECTORS = byte_table({
+    0: "SECTOR_1",
+    1: "SECTOR_2",
+    2: "SECTOR_3",
+    3: "SECTOR_4",
+    4: "SECTOR_5",
+    5: "SECTOR_6",
+    7: "SECTOR_7",
+    8: "SECTOR_8",
+    0xFE: "LAST_SECTOR",
+    0xFF: "NO_SECTOR",
+})
+
+# Sector numbering in the advertisements
+ADVERTISED_SECTORS = tuple(["NO_SECTOR"] + ["SECTOR_" + str(index) for index in range(1, 254)] + ["LAST_SECTOR", "NO_SECTOR"])
+
+# The pressure byte in the advertisements also encodes button presses
+PASSIVE_PRESSURES = byte_table({
+    0: "normal",
+    16: "normal",
+    32: "normal",
+    48: "normal",
+    50: "normal",
+    56: "power button pressed",
+    80: "normal",
+    82: "normal",
+    86: "button pressed",
+    90: "power button pressed",
+    114: "normal",
+    118: "button pressed",
+    122: "power button pressed",
+    144: "high",
+    146: "high",
+    150: "button pressed",
+    154: "power button pressed",
+    178: "high",
+    182: "button pressed",
+    186: "power button pressed",
+    192: "high",
+    240: "high",
+    242: "high",
+}, default="normal")
+
+# The pressure characteristic
+PRESSURES = byte_table({
+    0: "low",
+    1: "normal",
+    2: "high",
+})
+
+_PRESSURE_VALUES = {
+    "low": LOW_PRESSURE,
+    "normal": NORMAL_PRESSURE,
+    "high": HIGH_PRESSURE,
+}
+PASSIVE_PRESSURE_VALUES = tuple(_PRESSURE_VALUES.get(state, NORMAL_PRESSURE) for state in PASSIVE_PRESSURES)
+PRESSURE_VALUES = tuple(_PRESSURE_VALUES.get(state) for state in PRESSURES)
+
+
+
+def decode_time(result, data):
+    result.brush_time = 60 * data[0] + data[1]
+
+def decode_battery(result, data):
+    result.battery = data[0]
+
+def decode_status(result, data):
+    result.status = STATUSES[data[0]]
+
+def decode_mode(result, data):
+    result.mode = MODES[data[0]]
+
+def decode_sector(result, data):
+    result.sector = SECTORS[data[0]]
+    result.sector_time = data[1]
+
+def decode_pressure(result, data):
+    result.pressure_state = PRESSURES[data[0]]
+    result.pressure = PRESSURE_VALUES[data[0]]
+
+
+DECODERS = {
+    TIME_CHARACTERISTIC: decode_time,
+    BATTERY_CHARACTERISTIC: decode_battery,
+    STATUS_CHARACTERISTIC: decode_status,
+    MODE_CHARACTERISTIC: decode_mode,
+    SECTOR_CHARACTERISTIC: decode_sector,
+    PRESSURE_CHARACTERISTIC: decode_pressure,
+}
+
+
+def advertised_status(data):
+    """Get just the status from the manufacturer specific advertisement data."""
+    if data == None or len(data) < 9:
+        return None
+    return STATUSES[data[3]]
+
+
+def decode_advertisement(result, data):
+    """Decode the manufacturer specific advertisement data into result. Returns False if it wasn't valid.
+
+    Layout, as also used by the oralb-ble parser:
+    [0:3] device info, [3] status, [4] pressure, [5:7] minutes and seconds, [7] mode, [8] sector, [9] sector time
+    """
+    if data == None or len(data) < 9:
+        return False
+
+    result.status = STATUSES[data[3]]
+    result.pressure_state = PASSIVE_PRESSURES[data[4]]
+    result.pressure = PASSIVE_PRESSURE_VALUES[data[4]]
+    result.brush_time = 60 * data[5] + data[6]
+    result.mode = MODES[data[7]]
+    result.sector = ADVERTISED_SECTORS[data[8]]
+    if len(data) > 9:
+        result.sector_time = data[9]
+    return True
@@ -0,0 +1,120 @@
+"""Persistent data store for the Toothbrush adapter."""
+
+import os
+import json
+import threading
+
+
+_WRITE_DELAY = 2 # seconds. Changes made within this time are written to disk together.
+
+
+
+class PersistentStore:
+    """Keeps the persistent data in memory, and writes it to disk in the background once it has changed.
+
+    Every write goes to a temporary file first, which then replaces the real file. The previous
+    version is kept as a backup, so a crash or power cut during a write never loses the data.
+    """
+
+    def __init__(self, file_path, default, debug=False, write_delay=_WRITE_DELAY):
+        self.file_path = file_path
+        self.backup_file_path = file_path + '.bak'
+        self.temporary_file_path = file_path + '.tmp'
+        self.default = default
+        self.debug = debug
+        self.write_delay = write_delay
+
+        self.data = None
+        self.dirty = False
+        self.timer = None
+        self.lock = threading.Lock() # guards the dirty flag and the timer. Never held during file I/O.
+        self.write_lock = threading.Lock() # makes sure an older snapshot can't overwrite a newer one
+
+
+    def load(self):
+        """Load the data from disk, falling back to the last good snapshot if the file is damaged."""
+        for file_path in (self.file_path, self.backup_file_path):
+            try:
+                with open(file_path) as f:
+                    self.data = json.load(f)
+                if self.debug:
+                    print("Persistence data was loaded succesfully from: ", file_path)
+                return self.data
+            except FileNotFoundError:
+                pass
+            except Exception as ex:
+                print("Could not load persistent data from " + str(file_path) + ": " + str(ex))
+
+        print("No persistent data found (if you just installed the add-on then this is normal).")
+        self.data = json.loads(json.dumps(self.default))
+        return self.data
+
+
+    def mark_dirty(self):
+        """Remember that the data has changed, and schedule a write if one isn't pending already."""
+        with self.lock:
+            self.dirty = True
+            if self.timer == None:
+                self.timer = threading.Timer(self.write_delay, self._write_behind)
+                self.timer.daemon = True
+                self.timer.start()
+
+
+    def _write_behind(self):
+        with self.lock:
+            self.timer = None
+        if not self.flush():
+            # Try again later, for example if the data was being changed while it was being serialised
+            self.mark_dirty()
+
+
+    def flush(self):
+        """Write the data to disk right away, if it has changed. Returns False if that failed."""
+        with self.write_lock:
+            # Only take a snapshot while holding the lock, so that mark_dirty never has to wait for the disk
+            with self.lock:
+                if not self.dirty:
+                    return True
+                self.dirty = False
+                try:
+                    serialised = json.dumps(self.data, separators=(',', ':'))
+                except Exception as ex:
+                    print("Error: could not serialise persistent data: " + str(ex))
+                    self.dirty = True
+                    return False
+
+            try:
+                with open(self.temporary_file_path, 'w') as f:
+                    f.write(serialised)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                if os.path.isfile(self.file_path):
+                    os.replace(self.file_path, self.backup_file_path)
+                os.replace(self.temporary_file_path, self.file_path)
+
+                # Make sure the renames themselves are on disk too
+                directory = os.open(os.path.dirname(self.file_path), os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+
+                if self.debug:
+                    print("saved persistent data to: ", self.file_path)
+                return True
+
+            except Exception as ex:
+                print("Error: could not store data in persistent store: " + str(ex))
+                with self.lock:
+                    self.dirty = True
+                return False
+
+
+    def close(self):
+        """Cancel the pending write and write any changes immediately."""
+        with self.lock:
+            if self.timer != None:
+                self.timer.cancel()
+                self.timer = None
+        self.flush()
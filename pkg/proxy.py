@@ -0,0 +1,476 @@
+"""Bluetooth proxies: small processes on other machines that extend the reach of the Toothbrush adapter.
+
+A proxy runs closer to a bathroom that is out of the gateway's radio range, and connects to the
+adapter over TCP. It forwards the advertisements of the toothbrushes it picks up, and makes GATT
+connections, reads and notifications on behalf of the adapter. The adapter treats every proxy as
+one more Bluetooth controller, so each toothbrush is connected through whichever proxy or local
+controller receives it best. On the other machine:
+
+    python3 -m pkg.proxy --gateway 192.168.1.10:8765 --key <proxy key> --name bathroom
+
+With --simulate the proxy uses simulated toothbrushes instead of a radio, which makes it possible to
+try the whole setup on a single machine.
+
+The messages are JSON objects, one per line, and binary values are sent as hex strings. The adapter
+starts with a 'challenge', and the proxy answers with a 'hello' that proves it knows the proxy key,
+without sending the key itself. Requests from the adapter carry an 'id', which the proxy answers with a
+'result' or an 'error'. Advertisements, notifications and lost connections are sent by the proxy
+as they happen.
+"""
+
+import sys
+import hmac
+import json
+import time
+import socket
+import hashlib
+import logging
+import secrets
+import asyncio
+import argparse
+import itertools
+import functools
+
+from . import drivers
+from .connection import Advertisement, Characteristic, Service
+
+
+_LOGGER = logging.getLogger(__name__)
+
+
+PROTOCOL_VERSION = 2
+CONTROLLER_PREFIX = 'proxy:' # proxies show up as controllers named after them, such as 'proxy:bathroom'
+
+_HELLO_TIMEOUT = 10 # seconds for a proxy to introduce itself
+_REQUEST_TIMEOUT = 30 # seconds for a proxy to answer a request
+_CONNECT_TIMEOUT = 60 # seconds, as the proxy may need several attempts to connect
+_RECONNECT_DELAY = 5 # seconds before a proxy tries to reach the adapter again
+
+
+
+def authentication(key, nonce):
+    """Prove knowledge of the proxy key for a single challenge."""
+    return hmac.new(key.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+
+def encode(message):
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+
+class RemoteDevice:
+    """Takes the place of a BLEDevice, for a toothbrush that a proxy picked up."""
+
+    def __init__(self, address, name, rssi, node):
+        self.address = address
+        self.name = name
+        self.rssi = rssi
+        self.details = node
+
+    def __repr__(self):
+        return self.address + ": " + str(self.name) + " (via " + self.details.name + ")"
+
+
+
+def service_table(services):
+    """Turn a collection of discovered services into something that can be sent as JSON."""
+    table = []
+    for service in services:
+        table.append({
+            'uuid':str(service.uuid),
+            'handle':service.handle,
+            'characteristics':[{
+                'uuid':str(characteristic.uuid),
+                'handle':characteristic.handle,
+                'properties':list(characteristic.properties),
+            } for characteristic in service.characteristics],
+        })
+    return table
+
+
+def services_from_table(table):
+    """Turn a service table, as made by service_table, back into services."""
+    return [Service(service['uuid'], service['handle'], [
+        Characteristic(characteristic['uuid'], characteristic['handle'], characteristic['properties'])
+        for characteristic in service['characteristics']
+    ]) for service in table]
+
+
+
+class RemoteClient:
+    """Takes the place of a BleakClient, for a connection that a proxy holds for the adapter."""
+
+    def __init__(self, node, connection_id, services, disconnected_callback):
+        self.node = node
+        self.connection_id = connection_id
+        self.services = services
+        self.disconnected_callback = disconnected_callback
+        self.notify_handlers = {}
+        self.is_connected = True
+
+    async def read_gatt_char(self, characteristic):
+        value = await self.node.request({'type':'read', 'connection':self.connection_id, 'characteristic':str(characteristic)})
+        return bytearray.fromhex(value)
+
+    async def start_notify(self, characteristic, callback):
+        self.notify_handlers[str(characteristic)] = callback
+        await self.node.request({'type':'start_notify', 'connection':self.connection_id, 'characteristic':str(characteristic)})
+
+    async def stop_notify(self, characteristic):
+        self.notify_handlers.pop(str(characteristic), None)
+        await self.node.request({'type':'stop_notify', 'connection':self.connection_id, 'characteristic':str(characteristic)})
+
+    async def disconnect(self):
+        if not self.is_connected:
+            return
+        try:
+            await self.node.request({'type':'disconnect', 'connection':self.connection_id})
+        finally:
+            self.lost()
+
+    def notification(self, characteristic, value):
+        callback = self.notify_handlers.get(characteristic)
+        if callback != None:
+            callback(characteristic, bytearray.fromhex(value))
+
+    def lost(self):
+        """The proxy dropped the connection, or the proxy itself is gone."""
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        self.node.clients.pop(self.connection_id, None)
+        if self.disconnected_callback != None:
+            self.disconnected_callback(self)
+
+
+
+class ProxyNode:
+    """A proxy that is connected to the adapter."""
+
+    def __init__(self, hub, name, writer):
+        self.hub = hub
+        self.name = name
+        self.controller = CONTROLLER_PREFIX + name
+        self.writer = writer
+        self.request_ids = itertools.count(1)
+        self.requests = {} # request id -> future that gets the result
+        self.clients = {} # connection id -> RemoteClient
+        self.devices = {} # address -> RemoteDevice
+
+    async def request(self, message, timeout=_REQUEST_TIMEOUT):
+        """Send a request to the proxy and wait for its result."""
+        request_id = next(self.request_ids)
+        message['id'] = request_id
+        future = asyncio.get_running_loop().create_future()
+        self.requests[request_id] = future
+        try:
+            self.writer.write(encode(message))
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.requests.pop(request_id, None)
+
+    async def connect(self, address, use_services_cache, disconnected_callback):
+        result = await self.request({'type':'connect', 'address':address, 'use_services_cache':use_services_cache}, _CONNECT_TIMEOUT)
+        client = RemoteClient(self, result['connection'], services_from_table(result['services']), disconnected_callback)
+        self.clients[client.connection_id] = client
+        return client
+
+    async def clear_cache(self, client):
+        await self.request({'type':'clear_cache', 'connection':client.connection_id})
+
+    def handle(self, message):
+        kind = message.get('type')
+        if kind == 'advertisement':
+            self.advertisement(message)
+        elif kind == 'notification':
+            client = self.clients.get(message['connection'])
+            if client != None:
+                client.notification(message['characteristic'], message['value'])
+        elif kind == 'disconnected':
+            client = self.clients.get(message['connection'])
+            if client != None:
+                client.lost()
+        elif kind in ('result', 'error'):
+            future = self.requests.get(message.get('id'))
+            if future != None and not future.done():
+                if kind == 'result':
+                    future.set_result(message.get('value'))
+                else:
+                    future.set_exception(Exception("proxy " + self.name + ": " + str(message.get('error'))))
+
+    def advertisement(self, message):
+        address = message['address']
+        device = self.devices.get(address)
+        if device == None:
+            device = RemoteDevice(address, message.get('name'), None, self)
+            self.devices[address] = device
+        device.name = message.get('name')
+        device.rssi = message.get('rssi')
+        manufacturer_data = {int(manufacturer_id):bytes.fromhex(data) for manufacturer_id, data in message.get('manufacturer_data', {}).items()}
+        advertisement_data = Advertisement(device.name, manufacturer_data, device.rssi)
+        advertisement_data.service_uuids = message.get('service_uuids', [])
+        self.hub.adapter.handle_detection(time.time(), device, advertisement_data, self.controller)
+
+    def closed(self):
+        """The proxy went away. Fail what was still waiting for it, and drop its connections."""
+        for future in self.requests.values():
+            if not future.done():
+                future.set_exception(ConnectionError("proxy " + self.name + " disconnected"))
+        for client in list(self.clients.values()):
+            client.lost()
+
+
+
+class ProxyHub:
+    """Accepts connections from proxies, and feeds what they pick up into the adapter."""
+
+    def __init__(self, adapter, port, key=''):
+        self.adapter = adapter
+        self.port = port
+        self.key = key
+        self.nodes = {} # controller name -> ProxyNode
+        self.writers = set()
+
+    async def serve(self):
+        # Anything on the network could pretend to be a proxy and feed the adapter made up toothbrushes
+        if not self.key:
+            print("Error: Bluetooth proxies are disabled, because no proxy key has been set")
+            return
+        server = await asyncio.start_server(self.handle_proxy, port=self.port)
+        print("Waiting for Bluetooth proxies on port " + str(self.port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for writer in list(self.writers):
+                writer.close()
+
+    async def handle_proxy(self, reader, writer):
+        self.writers.add(writer)
+        node = None
+        try:
+            nonce = secrets.token_hex(16)
+            writer.write(encode({'type':'challenge', 'version':PROTOCOL_VERSION, 'nonce':nonce}))
+            hello = json.loads(await asyncio.wait_for(reader.readline(), _HELLO_TIMEOUT))
+            if hello.get('type') != 'hello' or hello.get('version') != PROTOCOL_VERSION:
+                print("Ignoring Bluetooth proxy that does not speak protocol version " + str(PROTOCOL_VERSION))
+                return
+            if not hmac.compare_digest(str(hello.get('auth', '')), authentication(self.key, nonce)):
+                print("Ignoring Bluetooth proxy with the wrong key: " + str(hello.get('name')))
+                return
+
+            node = ProxyNode(self, str(hello.get('name') or writer.get_extra_info('peername')[0]), writer)
+            old_node = self.nodes.get(node.controller)
+            if old_node != None:
+                old_node.writer.close()
+            self.nodes[node.controller] = node
+            self.adapter.controllers.add(node.controller, self.adapter.max_connections)
+            print("Bluetooth proxy connected: " + node.name)
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    node.handle(json.loads(line))
+                except Exception as ex:
+                    _LOGGER.warning("error handling message from Bluetooth proxy %s: %s", node.name, ex, extra={'device':node.controller})
+
+        except Exception as ex:
+            print("Bluetooth proxy connection error: " + str(ex))
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            if node != None:
+                node.closed()
+                if self.nodes.get(node.controller) == node:
+                    del self.nodes[node.controller]
+                    self.adapter.controllers.fail(node.controller)
+                    print("Bluetooth proxy disconnected: " + node.name)
+
+
+
+class ProxyBackend:
+    """Connects through a proxy when a toothbrush is placed on one, and leaves everything else to the local backend."""
+
+    name = 'proxy'
+
+    def __init__(self, local, hub):
+        self.local = local
+        self.hub = hub
+
+    def scanner(self, detection_callback, controller=None):
+        return self.local.scanner(detection_callback, controller)
+
+    async def connect(self, ble_device, name, disconnected_callback, cached_services=None, ble_device_callback=None, use_services_cache=False, controller=None):
+        if controller != None and controller.startswith(CONTROLLER_PREFIX):
+            node = self.hub.nodes.get(controller)
+            if node == None:
+                raise Exception("Bluetooth proxy " + controller + " is not connected")
+            return await node.connect(ble_device.address, use_services_cache, disconnected_callback)
+        return await self.local.connect(ble_device, name, disconnected_callback, cached_services, ble_device_callback, use_services_cache, controller)
+
+    async def clear_cache(self, client):
+        if isinstance(client, RemoteClient):
+            try:
+                await client.node.clear_cache(client)
+            except Exception as ex:
+                print("could not clear the GATT service cache of the proxy: ", ex)
+            return
+        await self.local.clear_cache(client)
+
+
+
+class Proxy:
+    """The proxy process. Scans with its own backend, and serves the adapter."""
+
+    def __init__(self, backend, name, host, port, key='', controller=None):
+        self.backend = backend
+        self.name = name
+        self.host = host
+        self.port = port
+        self.key = key
+        self.controller = controller
+        self.writer = None
+        self.connection_ids = itertools.count(1)
+        self.devices = {} # address -> the latest ble_device
+        self.clients = {} # connection id -> client
+
+    async def run(self):
+        """Stay connected to the adapter."""
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except Exception as ex:
+                print("Could not reach the adapter at " + self.host + ":" + str(self.port) + ": " + str(ex))
+                await asyncio.sleep(_RECONNECT_DELAY)
+                continue
+
+            print("Connected to the adapter at " + self.host + ":" + str(self.port))
+            try:
+                await self.session(reader, writer)
+            except Exception as ex:
+                print("Lost the connection to the adapter: " + str(ex))
+            finally:
+                writer.close()
+                self.writer = None
+                for client in list(self.clients.values()):
+                    try:
+                        await client.disconnect()
+                    except Exception:
+                        pass
+                self.clients = {}
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+    async def session(self, reader, writer):
+        self.writer = writer
+        challenge = json.loads(await asyncio.wait_for(reader.readline(), _HELLO_TIMEOUT))
+        if challenge.get('type') != 'challenge' or challenge.get('version') != PROTOCOL_VERSION:
+            raise Exception("the adapter does not speak protocol version " + str(PROTOCOL_VERSION))
+        self.send({'type':'hello', 'version':PROTOCOL_VERSION, 'name':self.name, 'auth':authentication(self.key, str(challenge.get('nonce')))})
+        tasks = set()
+        async with self.backend.scanner(self.detected, self.controller):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.handle(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        for task in tasks:
+            task.cancel()
+
+    def send(self, message):
+        if self.writer != None and not self.writer.is_closing():
+            self.writer.write(encode(message))
+
+    def detected(self, ble_device, advertisement_data):
+        # Only toothbrushes are forwarded, to keep the traffic down
+        if drivers.match(ble_device.name, advertisement_data.manufacturer_data, advertisement_data.service_uuids) == None:
+            return
+        self.devices[ble_device.address] = ble_device
+        self.send({
+            'type':'advertisement',
+            'address':ble_device.address,
+            'name':ble_device.name,
+            'rssi':advertisement_data.rssi,
+            'manufacturer_data':{str(manufacturer_id):bytes(data).hex() for manufacturer_id, data in advertisement_data.manufacturer_data.items()},
+            'service_uuids':list(advertisement_data.service_uuids),
+        })
+
+    async def handle(self, message):
+        try:
+            self.send({'type':'result', 'id':message.get('id'), 'value':await self.command(message)})
+        except Exception as ex:
+            self.send({'type':'error', 'id':message.get('id'), 'error':str(ex)})
+
+    async def command(self, message):
+        kind = message.get('type')
+        if kind == 'connect':
+            ble_device = self.devices.get(message['address'])
+            if ble_device == None:
+                raise Exception("toothbrush " + str(message['address']) + " has not been seen by this proxy")
+            connection_id = next(self.connection_ids)
+            client = await self.backend.connect(ble_device, self.name, functools.partial(self.disconnected, connection_id),
+                                                use_services_cache=bool(message.get('use_services_cache')), controller=self.controller)
+            self.clients[connection_id] = client
+            return {'connection':connection_id, 'services':service_table(client.services)}
+
+        connection_id = message.get('connection')
+        client = self.clients.get(connection_id)
+        if client == None:
+            raise Exception("not connected")
+        if kind == 'read':
+            return bytes(await client.read_gatt_char(message['characteristic'])).hex()
+        if kind == 'start_notify':
+            await client.start_notify(message['characteristic'], functools.partial(self.notification, connection_id, message['characteristic']))
+            return None
+        if kind == 'stop_notify':
+            await client.stop_notify(message['characteristic'])
+            return None
+        if kind == 'disconnect':
+            self.clients.pop(connection_id, None)
+            await client.disconnect()
+            return None
+        if kind == 'clear_cache':
+            await self.backend.clear_cache(client)
+            return None
+        raise Exception("unknown request: " + str(kind))
+
+    def notification(self, connection_id, characteristic, sender, data):
+        self.send({'type':'notification', 'connection':connection_id, 'characteristic':characteristic, 'value':bytes(data).hex()})
+
+    def disconnected(self, connection_id, client):
+        if self.clients.pop(connection_id, None) != None:
+            self.send({'type':'disconnected', 'connection':connection_id})
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forward the toothbrushes this machine can reach to the Toothbrush adapter.")
+    parser.add_argument('--gateway', required=True, help="host:port of the adapter, as set in its 'Proxy port' setting")
+    parser.add_argument('--name', default=socket.gethostname(), help="name of this proxy, for example the room it is in")
+    parser.add_argument('--key', required=True, help="the 'Proxy key' from the add-on settings")
+    parser.add_argument('--controller', default=None, help="the Bluetooth controller to use, such as hci1")
+    parser.add_argument('--simulate', type=int, default=0, help="use this many simulated toothbrushes instead of a radio")
+    args = parser.parse_args(argv)
+
+    host, _, port = args.gateway.rpartition(':')
+    if args.simulate > 0:
+        from .simulator import SimulatedBackend
+        backend = SimulatedBackend(args.simulate, controllers=[args.controller])
+    else:
+        from .ble_backend import BleakBackend
+        backend = BleakBackend()
+
+    try:
+        asyncio.run(Proxy(backend, args.name, host or 'localhost', int(port), args.key, args.controller).run())
+    except KeyboardInterrupt:
+        pass
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Replays a capture file through the Toothbrush adapter, as fast as possible.
+
+The recorded advertisements, polls and notifications go through the same decoding, session
+recording and property updates as live data, using the recorded timestamps, so a problem that was
+captured in the field can be reproduced, profiled and regression tested without any hardware:
+
+    python3 -m pkg.replay captures/capture-20240101-120000.tbcap --changes
+"""
+
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+from .toothbrush import ToothbrushAdapter
+from .offline import OfflineAdapter
+from .identity import normalise_address
+from .connection import Advertisement
+from .simulator import SimulatedDevice
+from . import capture
+
+
+
+class ReplayAdapter(ToothbrushAdapter, OfflineAdapter):
+    """The Toothbrush adapter, fed from a capture file instead of the radio."""
+
+    def __init__(self, dir_path, passive_mode):
+        self.offline_dir_path = dir_path
+        self.replay_passive_mode = passive_mode
+        ToothbrushAdapter.__init__(self, verbose=False)
+
+    def add_from_config(self):
+        self.DEBUG = False
+        self.passive_mode = self.replay_passive_mode
+
+    def start_bluetooth(self):
+        # The replay calls the handlers itself. Only warnings are logged, to keep the output readable.
+        self.log.logger.setLevel(logging.WARNING)
+
+    def find_toothbrush(self, address):
+        toothbrush_thing_id = self.identities.thing_id(normalise_address(address))
+        return toothbrush_thing_id, self.oralb_toothbrushes.get(toothbrush_thing_id)
+
+
+
+def replay(file_path, passive_mode=True, listener=None):
+    """Feed a capture file through the adapter. Returns some counts, and how long it took."""
+    dir_path = tempfile.mkdtemp(prefix='toothbrush-replay-')
+    adapter = ReplayAdapter(dir_path, passive_mode)
+    adapter.manager_proxy.listener = listener
+    counts = {capture.ADVERTISEMENT:0, capture.POLL:0, capture.NOTIFICATION:0}
+    devices = {} # address -> SimulatedDevice
+    first_time = None
+    last_time = None
+
+    start = time.perf_counter()
+    try:
+        for kind, record_time, address, name, value in capture.read_capture(file_path):
+            counts[kind] += 1
+            if first_time == None:
+                first_time = record_time
+            last_time = record_time
+
+            ble_device = devices.get(address)
+            if ble_device == None:
+                ble_device = SimulatedDevice(address, name, None, None)
+                devices[address] = ble_device
+
+            if kind == capture.ADVERTISEMENT:
+                rssi, manufacturer_data, service_uuids = value
+                ble_device.rssi = rssi
+                adapter.handle_detection(record_time, ble_device, Advertisement(name, manufacturer_data, rssi, service_uuids))
+                continue
+
+            toothbrush_thing_id, oralb_device = adapter.find_toothbrush(address)
+            if oralb_device == None:
+                # The toothbrush was polled before it was seen in this capture, so announce it by name
+                adapter.handle_detection(record_time, ble_device, Advertisement(name, {}, ble_device.rssi))
+                toothbrush_thing_id, oralb_device = adapter.find_toothbrush(address)
+                if oralb_device == None:
+                    continue
+
+            values = value if kind == capture.POLL else [value]
+            for characteristic, data in values:
+                if characteristic in oralb_device.decoder.DECODERS:
+                    oralb_device.decode_characteristic(characteristic, data)
+            adapter.update_toothbrush_thing(toothbrush_thing_id, oralb_device.result, record_time)
+
+        elapsed = time.perf_counter() - start
+        adapter.session_recorder.close_all()
+        sessions = {toothbrush_thing_id:len(adapter.session_recorder.load_sessions(toothbrush_thing_id)) for toothbrush_thing_id in adapter.devices}
+    finally:
+        adapter.unload()
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+    return {
+        'advertisements':counts[capture.ADVERTISEMENT],
+        'polls':counts[capture.POLL],
+        'notifications':counts[capture.NOTIFICATION],
+        'property_changes':adapter.manager_proxy.property_changes,
+        'sessions':sessions,
+        'captured_seconds':(last_time - first_time) if first_time != None else 0,
+        'replay_seconds':elapsed,
+    }
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a toothbrush capture file through the adapter.")
+    parser.add_argument('file', help="the capture file")
+    parser.add_argument('--connected', action='store_true', help="replay as if connectionless mode was disabled, so advertisements don't update the properties")
+    parser.add_argument('--changes', action='store_true', help="print every property change")
+    args = parser.parse_args(argv)
+
+    listener = None
+    if args.changes:
+        listener = lambda prop: print(prop.device.id, prop.name, prop.value)
+
+    result = replay(args.file, not args.connected, listener)
+
+    print("advertisements:   " + str(result['advertisements']))
+    print("polls:            " + str(result['polls']))
+    print("notifications:    " + str(result['notifications']))
+    print("property changes: " + str(result['property_changes']))
+    print("sessions:         " + str(result['sessions']))
+    speedup = result['captured_seconds'] / result['replay_seconds'] if result['replay_seconds'] else 0
+    print("replayed " + format(result['captured_seconds'], '.1f') + " captured seconds in " + format(result['replay_seconds'], '.3f') + " seconds (" + format(speedup, '.0f') + "x real time)")
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
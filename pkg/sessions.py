@@ -0,0 +1,263 @@
+"""Brushing session history for the Toothbrush adapter.
+
+Every toothbrush gets two append-only files in the sessions directory:
+
+<toothbrush_thing_id>.samples -- one fixed-width record per second of brushing
+<toothbrush_thing_id>.index   -- one fixed-width summary record per brushing session
+
+A session of two minutes takes up about 600 bytes, so years of history fit in a few megabytes.
+"""
+
+import os
+import time
+import struct
+
+
+# brush_time, sector_time, mode, sector (low 4 bits) and pressure (high 4 bits)
+_SAMPLE = struct.Struct('<HBBB')
+
+# start time, number of the first sample, sample count, duration, seconds with high pressure, mode, seconds per sector
+_SUMMARY = struct.Struct('<IIHHHB8B')
+
+_MODE_CODES = {
+    "OFF": 0,
+    "DAILY_CLEAN": 1,
+    "SENSITIVE": 2,
+    "GUM_CARE": 3,
+    "WHITEN": 4,
+    "TONGUE_CLEAN": 6,
+    "INTENSE": 7,
+}
+_MODE_NAMES = {code:name for name, code in _MODE_CODES.items()}
+_UNKNOWN = 255
+
+_NO_SECTOR = 0
+_LAST_SECTOR = 15
+_NO_PRESSURE = 15
+_HIGH_PRESSURE = 2
+
+_MIN_SESSION_DURATION = 3 # seconds. Shorter sessions are most likely accidental button presses.
+_CLOSE_DELAY = 30 # seconds that a session waits for brushing to resume before it ends
+
+
+
+def sector_number(sector):
+    """Turn a sector name like 'SECTOR_3' into a number that fits in four bits."""
+    if sector == None or sector == "NO_SECTOR":
+        return _NO_SECTOR
+    if sector == "LAST_SECTOR":
+        return _LAST_SECTOR
+    try:
+        return min(int(str(sector).split("_",1)[1]), _LAST_SECTOR - 1)
+    except Exception:
+        return _NO_SECTOR
+
+
+
+class BrushingSession:
+    """A brushing session that is still in progress."""
+
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.samples = bytearray()
+        self.sample_count = 0
+        self.duration = 0
+        self.high_pressure_time = 0
+        self.mode = _UNKNOWN
+        self.sector_times = [0] * 8
+        self.last_brush_time = None
+        self.last_data_time = None
+        self.stop_time = None # when the toothbrush stopped running, while the session waits to see if it resumes
+
+    def add_sample(self, brush_time, sector_time, mode, sector, pressure):
+        if pressure == None:
+            pressure = _NO_PRESSURE
+        pressure = max(0, min(int(pressure), _NO_PRESSURE))
+
+        self.samples += _SAMPLE.pack(min(brush_time, 0xFFFF), min(sector_time, 255), mode, sector | (pressure << 4))
+        self.sample_count += 1
+        self.duration = max(self.duration, brush_time)
+        if pressure == _HIGH_PRESSURE:
+            self.high_pressure_time += 1
+        if mode != _UNKNOWN and mode != _MODE_CODES["OFF"]:
+            self.mode = mode
+        if 1 <= sector <= 8:
+            self.sector_times[sector - 1] = min(self.sector_times[sector - 1] + 1, 255)
+
+    def summary(self, first_sample):
+        return {
+            'start_time':int(self.start_time),
+            'first_sample':first_sample,
+            'sample_count':self.sample_count,
+            'duration':self.duration,
+            'high_pressure_time':self.high_pressure_time,
+            'mode':_MODE_NAMES.get(self.mode, "UNKNOWN"),
+            'sector_times':list(self.sector_times),
+        }
+
+
+
+class SessionRecorder:
+    """Records the brushing sessions of all toothbrushes."""
+
+    def __init__(self, data_dir_path, debug=False, close_delay=_CLOSE_DELAY):
+        self.sessions_dir_path = os.path.join(data_dir_path, 'sessions')
+        self.debug = debug
+        self.close_delay = close_delay
+        self.active_sessions = {} # toothbrush_thing_id -> BrushingSession
+
+        try:
+            if not os.path.isdir(self.sessions_dir_path):
+                os.mkdir(self.sessions_dir_path)
+        except Exception as ex:
+            print("failed to create sessions dir: ", ex)
+
+
+    def samples_path(self, toothbrush_thing_id):
+        return os.path.join(self.sessions_dir_path, str(toothbrush_thing_id) + '.samples')
+
+
+    def index_path(self, toothbrush_thing_id):
+        return os.path.join(self.sessions_dir_path, str(toothbrush_thing_id) + '.index')
+
+
+    def record(self, toothbrush_thing_id, data, now=None):
+        """Handle new toothbrush data. Returns the summary of a session if this data ended it.
+
+        A toothbrush that stops running doesn't end its session right away. If it runs again within the close delay,
+        and its brush time carried on, it is still the same session.
+
+        now -- when the data was received, if that wasn't just now
+        """
+        if now == None:
+            now = time.time()
+        session = self.active_sessions.get(toothbrush_thing_id)
+        summary = None
+        if session != None:
+            session.last_data_time = now
+
+        if data.status == "RUN" and data.brush_time != None:
+            brush_time = int(data.brush_time)
+
+            # A brush time that went back means the toothbrush started over
+            if session != None and session.last_brush_time != None and brush_time < session.last_brush_time:
+                summary = self.close(toothbrush_thing_id)
+                session = None
+
+            if session == None:
+                session = BrushingSession(now - brush_time)
+                session.last_data_time = now
+                self.active_sessions[toothbrush_thing_id] = session
+                if self.debug:
+                    print("brushing session started: ", toothbrush_thing_id)
+            session.stop_time = None
+
+            # Only keep one sample per second, even if the data arrives more often
+            if brush_time != session.last_brush_time:
+                session.last_brush_time = brush_time
+                session.add_sample(brush_time,
+                                   int(data.sector_time or 0),
+                                   _MODE_CODES.get(data.mode, _UNKNOWN),
+                                   sector_number(data.sector),
+                                   data.pressure)
+            return summary
+
+        # A paused toothbrush hasn't finished yet
+        if session != None and data.status != "PAUSE":
+            if session.stop_time == None:
+                session.stop_time = now
+            elif now - session.stop_time >= self.close_delay:
+                return self.close(toothbrush_thing_id)
+        return None
+
+
+    def expire(self, now, timeout):
+        """End the sessions that have waited long enough for brushing to resume, or that haven't had data for timeout
+        seconds. Returns the summaries of the sessions that ended, by toothbrush_thing_id."""
+        summaries = {}
+        for toothbrush_thing_id, session in list(self.active_sessions.items()):
+            if (session.stop_time != None and now - session.stop_time >= self.close_delay) or now - session.last_data_time > timeout:
+                summary = self.close(toothbrush_thing_id)
+                if summary != None:
+                    summaries[toothbrush_thing_id] = summary
+        return summaries
+
+
+    def close(self, toothbrush_thing_id):
+        """End the active session of a toothbrush, and append it to the history files."""
+        session = self.active_sessions.pop(toothbrush_thing_id, None)
+        if session == None or session.duration < _MIN_SESSION_DURATION:
+            return None
+
+        try:
+            samples_path = self.samples_path(toothbrush_thing_id)
+            first_sample = 0
+            if os.path.isfile(samples_path):
+                first_sample = os.path.getsize(samples_path) // _SAMPLE.size
+
+            summary = session.summary(first_sample)
+            with open(samples_path, 'ab') as f:
+                f.write(session.samples)
+            with open(self.index_path(toothbrush_thing_id), 'ab') as f:
+                f.write(_SUMMARY.pack(summary['start_time'],
+                                      first_sample,
+                                      min(session.sample_count, 0xFFFF),
+                                      min(session.duration, 0xFFFF),
+                                      min(session.high_pressure_time, 0xFFFF),
+                                      session.mode,
+                                      *session.sector_times))
+            if self.debug:
+                print("brushing session saved: ", toothbrush_thing_id, summary)
+            return summary
+
+        except Exception as ex:
+            print("Error: could not save brushing session: ", ex)
+            return None
+
+
+    def close_all(self):
+        for toothbrush_thing_id in list(self.active_sessions.keys()):
+            self.close(toothbrush_thing_id)
+
+
+    def load_sessions(self, toothbrush_thing_id):
+        """Get the summaries of all recorded sessions of a toothbrush, oldest first."""
+        summaries = []
+        try:
+            with open(self.index_path(toothbrush_thing_id), 'rb') as f:
+                index = f.read()
+        except FileNotFoundError:
+            return summaries
+
+        # A partially written record at the end is ignored
+        for fields in _SUMMARY.iter_unpack(index[:len(index) - (len(index) % _SUMMARY.size)]):
+            summaries.append({
+                'start_time':fields[0],
+                'first_sample':fields[1],
+                'sample_count':fields[2],
+                'duration':fields[3],
+                'high_pressure_time':fields[4],
+                'mode':_MODE_NAMES.get(fields[5], "UNKNOWN"),
+                'sector_times':list(fields[6:14]),
+            })
+        return summaries
+
+
+    def load_samples(self, toothbrush_thing_id, summary):
+        """Get the per-second samples of a single recorded session."""
+        samples = []
+        with open(self.samples_path(toothbrush_thing_id), 'rb') as f:
+            f.seek(summary['first_sample'] * _SAMPLE.size)
+            data = f.read(summary['sample_count'] * _SAMPLE.size)
+
+        for brush_time, sector_time, mode, packed in _SAMPLE.iter_unpack(data):
+            sector = packed & 0x0F
+            pressure = packed >> 4
+            samples.append({
+                'brush_time':brush_time,
+                'sector_time':sector_time,
+                'mode':_MODE_NAMES.get(mode, "UNKNOWN"),
+                'sector':None if sector == _NO_SECTOR else sector,
+                'pressure':None if pressure == _NO_PRESSURE else pressure,
+            })
+        return samples
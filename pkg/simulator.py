@@ -0,0 +1,280 @@
+"""A simulated Bluetooth backend, with any number of Oral-B toothbrushes.
+
+The simulated toothbrushes advertise, accept connections, answer GATT reads and send notifications
+with the same payloads as real ones, after a configurable delay and with a configurable failure
+rate. It makes it possible to run and measure the adapter without Bluetooth hardware.
+"""
+
+import time
+import random
+import asyncio
+
+from . import oralb_decoder
+from .connection import Advertisement, Characteristic, Service
+
+
+# Status, mode, sector and pressure bytes, as real toothbrushes send them
+_STATUS_IDLE = 2
+_STATUS_RUN = 3
+_MODE_DAILY_CLEAN = 1
+_ADVERTISED_PRESSURE_NORMAL = 0x30
+_ADVERTISED_PRESSURE_HIGH = 0xF0
+_SECTOR_BYTES = (0, 1, 2, 3, 4, 5, 7, 8) # sectors 1 to 8 in the GATT characteristic
+
+_SECTOR_LENGTH = 30 # seconds of brushing per sector
+_HIGH_PRESSURE_EVERY = 17 # seconds. Now and then the simulated user presses too hard.
+_NEIGHBOUR_MANUFACTURER_ID = 0x004C # the other devices around are phones
+
+
+
+class SimulatedDevice:
+    """Takes the place of a BLEDevice."""
+
+    def __init__(self, address, name, rssi, toothbrush):
+        self.address = address
+        self.name = name
+        self.rssi = rssi
+        self.details = toothbrush
+
+    def __repr__(self):
+        return self.address + ": " + self.name
+
+
+
+class SimulatedToothbrush:
+    """An Oral-B toothbrush that takes turns brushing and resting.
+
+    The state is derived from the clock, so it doesn't need a task of its own.
+    """
+
+    def __init__(self, index, session_length=120, rest_length=30, rng=None, controllers=(None,)):
+        rng = rng or random.Random(index)
+        self.address = "5C:00:00:00:" + format(index // 256, '02X') + ":" + format(index % 256, '02X')
+        self.name = oralb_decoder.DEVICE_NAME
+        self.rssi = rng.randint(-85, -45)
+        # Every controller is in a different spot, so receives the toothbrush a bit better or worse
+        self.controller_rssi = {controller:self.rssi + (rng.randint(-15, 15) if controller != None else 0) for controller in controllers}
+        self.session_length = session_length
+        self.rest_length = rest_length
+        self.phase = rng.uniform(0, session_length + rest_length) # so that they don't all start brushing together
+        self.battery = rng.randint(20, 100)
+        self.started = time.monotonic()
+        self.device = SimulatedDevice(self.address, self.name, self.rssi, self)
+        self.devices = {controller:SimulatedDevice(self.address, self.name, rssi, self) for controller, rssi in self.controller_rssi.items()}
+
+    def state(self):
+        """Get the status, brush time, sector (0 to 7), sector time and whether there is too much pressure."""
+        elapsed = (time.monotonic() - self.started + self.phase) % (self.session_length + self.rest_length)
+        if elapsed >= self.session_length:
+            return _STATUS_IDLE, int(self.session_length), 7, 0, False
+        brush_time = int(elapsed)
+        sector = min(brush_time // _SECTOR_LENGTH, 7)
+        high_pressure = brush_time > 0 and brush_time % _HIGH_PRESSURE_EVERY == 0
+        return _STATUS_RUN, brush_time, sector, brush_time % _SECTOR_LENGTH, high_pressure
+
+    def manufacturer_data(self):
+        status, brush_time, sector, sector_time, high_pressure = self.state()
+        return bytes((
+            0x06, 0x2A, 0x01,
+            status,
+            _ADVERTISED_PRESSURE_HIGH if high_pressure else _ADVERTISED_PRESSURE_NORMAL,
+            brush_time // 60, brush_time % 60,
+            _MODE_DAILY_CLEAN,
+            sector + 1,
+            sector_time,
+        ))
+
+    def advertisement(self, controller=None):
+        rssi = self.controller_rssi.get(controller, self.rssi)
+        return Advertisement(self.name, {oralb_decoder.MANUFACTURER_ID:self.manufacturer_data()}, rssi)
+
+    def read(self, characteristic):
+        """Get the value of a GATT characteristic."""
+        status, brush_time, sector, sector_time, high_pressure = self.state()
+        if characteristic == oralb_decoder.TIME_CHARACTERISTIC:
+            return bytearray((brush_time // 60, brush_time % 60))
+        if characteristic == oralb_decoder.BATTERY_CHARACTERISTIC:
+            return bytearray((self.battery,))
+        if characteristic == oralb_decoder.STATUS_CHARACTERISTIC:
+            return bytearray((status,))
+        if characteristic == oralb_decoder.MODE_CHARACTERISTIC:
+            return bytearray((_MODE_DAILY_CLEAN,))
+        if characteristic == oralb_decoder.SECTOR_CHARACTERISTIC:
+            return bytearray((_SECTOR_BYTES[sector], sector_time))
+        if characteristic == oralb_decoder.PRESSURE_CHARACTERISTIC:
+            return bytearray((oralb_decoder.HIGH_PRESSURE if high_pressure else oralb_decoder.NORMAL_PRESSURE,))
+        raise Exception("Characteristic " + str(characteristic) + " was not found")
+
+
+
+# The service table of the simulated toothbrushes
+_SERVICES = (
+    Service(oralb_decoder.SERVICE_UUID, 0x0010, [
+        Characteristic(characteristic, 0x0011 + 3 * index, ['read', 'notify'])
+        for index, characteristic in enumerate(oralb_decoder.ALL_CHARACTERISTICS)
+    ]),
+)
+
+
+
+class SimulatedScanner:
+    """Calls the detection callback with an advertisement of every toothbrush, at the advertisement interval."""
+
+    def __init__(self, backend, detection_callback, controller=None):
+        self.backend = backend
+        self.detection_callback = detection_callback
+        self.controller = controller
+        self.task = None
+
+    async def __aenter__(self):
+        self.backend.check_controller(self.controller)
+        self.task = asyncio.create_task(self.advertise())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    async def advertise(self):
+        while True:
+            for toothbrush in self.backend.toothbrushes:
+                self.detection_callback(toothbrush.devices[self.controller], toothbrush.advertisement(self.controller))
+            # Like BlueZ with an advertisement monitor, filtering controllers drop the other devices before Python sees them
+            if not self.backend.scan_filters:
+                for device, advertisement in self.backend.neighbours:
+                    self.detection_callback(device, advertisement)
+            await asyncio.sleep(self.backend.advertisement_interval)
+            # The scanner stops when its controller is unplugged
+            self.backend.check_controller(self.controller)
+
+
+
+class SimulatedClient:
+    """Takes the place of a BleakClient that is connected to a simulated toothbrush."""
+
+    def __init__(self, backend, toothbrush, disconnected_callback, controller=None):
+        self.backend = backend
+        self.toothbrush = toothbrush
+        self.controller = controller
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = True
+        self.services = _SERVICES
+        self.notify_handlers = {}
+        self.notify_task = None
+
+    async def read_gatt_char(self, characteristic):
+        await self.backend.delay(self.backend.read_latency)
+        if not self.is_connected:
+            raise Exception("Not connected")
+        if self.backend.fails():
+            raise Exception("Simulated read failure")
+        return self.toothbrush.read(characteristic)
+
+    async def start_notify(self, characteristic, callback):
+        await self.backend.delay(self.backend.read_latency)
+        self.notify_handlers[characteristic] = callback
+        if self.notify_task == None:
+            self.notify_task = asyncio.create_task(self.notify())
+
+    async def stop_notify(self, characteristic):
+        self.notify_handlers.pop(characteristic, None)
+
+    async def notify(self):
+        while self.is_connected:
+            await asyncio.sleep(self.backend.notify_interval)
+            for characteristic, callback in list(self.notify_handlers.items()):
+                callback(characteristic, self.toothbrush.read(characteristic))
+
+    async def disconnect(self):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        if self.notify_task != None:
+            self.notify_task.cancel()
+        self.backend.connections -= 1
+        self.backend.controller_connections[self.controller] -= 1
+        self.backend.clients.remove(self)
+        if self.disconnected_callback != None:
+            self.disconnected_callback(self)
+
+
+
+class SimulatedBackend:
+    """A Bluetooth backend with a number of simulated toothbrushes.
+
+    count -- the number of toothbrushes
+    connect_latency, read_latency -- average seconds a connection or GATT read takes
+    discovery_latency -- average seconds it takes to discover the services, unless they are cached
+    failure_rate -- the fraction of connections and reads that fail
+    controllers -- the names of the simulated Bluetooth controllers. By default there is only the default one.
+    neighbours -- the number of other devices that advertise as often as the toothbrushes, like phones and watches next door
+    scan_filters -- whether the simulated controllers drop the advertisements of those other devices
+    advertisement_interval -- seconds between the advertisements of each toothbrush
+    notify_interval -- seconds between notifications while subscribed
+    seed -- makes the latencies and failures reproducible
+    """
+
+    name = 'simulator'
+
+    def __init__(self, count, connect_latency=0.2, read_latency=0.03, failure_rate=0.0, discovery_latency=1.5,
+                 advertisement_interval=0.1, notify_interval=1, session_length=120, rest_length=30, seed=0, controllers=None,
+                 neighbours=0, scan_filters=True):
+        self.rng = random.Random(seed)
+        self.controllers = list(controllers) if controllers else [None]
+        self.failed_controllers = set()
+        self.toothbrushes = [SimulatedToothbrush(index, session_length, rest_length, random.Random(seed + index), self.controllers) for index in range(count)]
+        self.connect_latency = connect_latency
+        self.discovery_latency = discovery_latency
+        self.cached_addresses = set() # the toothbrushes whose services the simulated BlueZ has cached
+        self.read_latency = read_latency
+        self.failure_rate = failure_rate
+        self.advertisement_interval = advertisement_interval
+        self.notify_interval = notify_interval
+        self.connections = 0
+        self.controller_connections = {controller:0 for controller in self.controllers}
+        self.clients = []
+        self.scan_filters = scan_filters
+        self.neighbours = []
+        for index in range(neighbours):
+            address = "6E:00:00:00:" + format(index // 256, '02X') + ":" + format(index % 256, '02X')
+            rssi = self.rng.randint(-100, -60)
+            self.neighbours.append((SimulatedDevice(address, None, rssi, None), Advertisement(None, {_NEIGHBOUR_MANUFACTURER_ID:bytes(12)}, rssi)))
+
+    def fails(self):
+        return self.failure_rate > 0 and self.rng.random() < self.failure_rate
+
+    async def delay(self, average):
+        """Wait for a random time around the average, like a real radio would."""
+        if average > 0:
+            await asyncio.sleep(self.rng.expovariate(1 / average))
+
+    def check_controller(self, controller):
+        if not controller in self.controllers or controller in self.failed_controllers:
+            raise Exception("Bluetooth controller " + str(controller) + " is not available")
+
+    def fail_controller(self, controller):
+        """Simulate unplugging a controller. Its scanner stops and its connections drop."""
+        self.failed_controllers.add(controller)
+        for client in list(self.clients):
+            if client.controller == controller:
+                asyncio.get_running_loop().create_task(client.disconnect())
+
+    def scanner(self, detection_callback, controller=None):
+        return SimulatedScanner(self, detection_callback, controller)
+
+    async def clear_cache(self, client):
+        self.cached_addresses.discard(client.toothbrush.address)
+
+    async def connect(self, ble_device, name, disconnected_callback, cached_services=None, ble_device_callback=None, use_services_cache=False, controller=None):
+        await self.delay(self.connect_latency)
+        self.check_controller(controller)
+        if self.fails():
+            raise Exception("Simulated connection failure")
+        if cached_services == None and not (use_services_cache and ble_device.address in self.cached_addresses):
+            await self.delay(self.discovery_latency)
+            self.cached_addresses.add(ble_device.address)
+        self.connections += 1
+        self.controller_connections[controller] += 1
+        client = SimulatedClient(self, ble_device.details, disconnected_callback, controller)
+        self.clients.append(client)
+        return client
@@ -0,0 +1,16 @@
+"""Driver for Philips Sonicare toothbrushes."""
+
+from .connection import ToothbrushConnection
+from . import sonicare_decoder
+
+
+
+class Sonicare(ToothbrushConnection):
+    """Connects to a Philips Sonicare toothbrush to get information.
+
+    Sonicare toothbrushes don't broadcast their state, so they are always polled over GATT, also in
+    connectionless mode.
+    """
+
+    brand = 'sonicare'
+    decoder = sonicare_decoder
@@ -0,0 +1,86 @@
+"""Decoder for the data that Philips Sonicare toothbrushes send over GATT.
+
+Sonicare toothbrushes don't broadcast their state, so everything is read over a connection. The
+characteristics and their values follow the reverse engineered protocol of the Sonicare app. The
+decoders write into the same ToothbrushData object as the Oral-B decoder, so that the things of both
+brands work the same way.
+"""
+
+from .drivers import BRANDS
+from .connection import byte_table
+
+
+# How Sonicare toothbrushes advertise themselves, as registered with the drivers
+MANUFACTURER_ID = None # the state is not in the advertisements
+SERVICE_UUID = BRANDS['sonicare'].service_uuids[0]
+DEVICE_NAME = BRANDS['sonicare'].names[0]
+
+MODE_CHARACTERISTIC = "477ea600-a260-11e4-ae37-0002a5d54080"
+STATUS_CHARACTERISTIC = "477ea600-a260-11e4-ae37-0002a5d54082"
+TIME_CHARACTERISTIC = "477ea600-a260-11e4-ae37-0002a5d54090"
+BATTERY_CHARACTERISTIC = "00002a19-0000-1000-8000-00805f9b34fb" # the standard battery level
+
+# The characteristics that are read during a normal poll
+ALL_CHARACTERISTICS = (
+    TIME_CHARACTERISTIC,
+    BATTERY_CHARACTERISTIC,
+    STATUS_CHARACTERISTIC,
+    MODE_CHARACTERISTIC,
+)
+BATTERY_CHARACTERISTICS = (BATTERY_CHARACTERISTIC,)
+
+# The characteristics that change during a brushing session
+NOTIFY_CHARACTERISTICS = (
+    TIME_CHARACTERISTIC,
+    STATUS_CHARACTERISTIC,
+)
+
+
+
+# The brushing state. A paused session is not brushing, like an Oral-B that is put down.
+STATUSES = byte_table({
+    0: "IDLE",
+    1: "RUN",
+    2: "PAUSE",
+    3: "IDLE", # session complete
+    4: "IDLE", # session aborted
+})
+
+MODES = byte_table({
+    0: "CLEAN",
+    1: "WHITE_PLUS",
+    2: "GUM_HEALTH",
+    3: "TONGUE_CARE",
+    4: "DEEP_CLEAN_PLUS",
+    5: "SENSITIVE",
+})
+
+
+
+def decode_time(result, data):
+    result.brush_time = data[0] + 256 * data[1]
+
+def decode_battery(result, data):
+    result.battery = data[0]
+
+def decode_status(result, data):
+    result.status = STATUSES[data[0]]
+
+def decode_mode(result, data):
+    result.mode = MODES[data[0]]
+
+
+DECODERS = {
+    TIME_CHARACTERISTIC: decode_time,
+    BATTERY_CHARACTERISTIC: decode_battery,
+    STATUS_CHARACTERISTIC: decode_status,
+    MODE_CHARACTERISTIC: decode_mode,
+}
+
+
+def advertised_status(data):
+    return None
+
+
+def decode_advertisement(result, data):
+    return False
@@ -0,0 +1,123 @@
+"""Brushing statistics for the Toothbrush adapter."""
+
+import datetime
+
+
+_WINDOW = 30 # days of daily totals that are kept
+
+
+
+def today():
+    return datetime.date.today().toordinal()
+
+
+
+class BrushingStatistics:
+    """Statistics of the brushing sessions of one toothbrush.
+
+    They are updated once when a session ends, using small daily totals, so reading them never
+    depends on how much history there is.
+    """
+
+    def __init__(self, data=None):
+        self.days = {} # day number -> [sessions, total brush time, sessions with a goal, goals reached]
+        self.sector_times = [0] * 8
+        self.streak = 0
+        self.streak_day = None
+
+        self.average_brush_time_week = None
+        self.average_brush_time_month = None
+        self.goal_hit_rate = None
+        self.current_streak = 0
+
+        if data:
+            try:
+                self.days = {int(day):list(totals) for day, totals in data.get('days', {}).items()}
+                self.sector_times = list(data.get('sector_times', self.sector_times))[:8]
+                self.streak = int(data.get('streak', 0))
+                self.streak_day = data.get('streak_day')
+            except Exception as ex:
+                print("could not load brushing statistics, starting over: ", ex)
+                self.days = {}
+
+        self.refresh()
+
+
+    def to_dict(self):
+        return {
+            'days':{str(day):totals for day, totals in self.days.items()},
+            'sector_times':self.sector_times,
+            'streak':self.streak,
+            'streak_day':self.streak_day,
+        }
+
+
+    def add_session(self, summary, brush_time_goal=None, day=None):
+        """Add the summary of a session that just ended."""
+        if day == None:
+            day = datetime.date.fromtimestamp(summary['start_time']).toordinal()
+
+        totals = self.days.setdefault(day, [0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += summary['duration']
+
+        goal_reached = True
+        if brush_time_goal:
+            goal_reached = summary['duration'] >= brush_time_goal
+            totals[2] += 1
+            if goal_reached:
+                totals[3] += 1
+
+        for index, seconds in enumerate(summary['sector_times'][:8]):
+            self.sector_times[index] += seconds
+
+        # A streak counts the days in a row on which the goal was reached
+        if goal_reached and self.streak_day != day:
+            if self.streak_day == day - 1:
+                self.streak += 1
+            else:
+                self.streak = 1
+            self.streak_day = day
+
+        self.refresh()
+
+
+    def refresh(self, day=None):
+        """Forget days that fell out of the window, and update the derived values."""
+        if day == None:
+            day = today()
+
+        for old_day in [d for d in self.days if d <= day - _WINDOW]:
+            del self.days[old_day]
+
+        self.average_brush_time_week = self._average_brush_time(day, 7)
+        self.average_brush_time_month = self._average_brush_time(day, _WINDOW)
+
+        goal_sessions = sum(totals[2] for totals in self.days.values())
+        goals_reached = sum(totals[3] for totals in self.days.values())
+        self.goal_hit_rate = round(100 * goals_reached / goal_sessions) if goal_sessions else None
+
+        if self.streak_day != None and day - self.streak_day <= 1:
+            self.current_streak = self.streak
+        else:
+            self.current_streak = 0
+
+
+    def _average_brush_time(self, day, period):
+        sessions = 0
+        brush_time = 0
+        for session_day, totals in self.days.items():
+            if session_day > day - period:
+                sessions += totals[0]
+                brush_time += totals[1]
+        if sessions == 0:
+            return None
+        return round(brush_time / sessions)
+
+
+    def sector_balance(self):
+        """Describe how the brushing time was spread over the sectors, for example '1: 25%, 2: 25%, 3: 26%, 4: 24%'."""
+        total = sum(self.sector_times)
+        if total == 0:
+            return ""
+        return ", ".join(str(index + 1) + ": " + str(round(100 * seconds / total)) + "%" for index, seconds in enumerate(self.sector_times) if seconds)
@@ -5,22 +5,39 @@ from os import path
 import sys
 sys.path.append(path.join(path.dirname(path.abspath(__file__)), 'lib'))
 
-import json
 import time
+_IMPORT_START = time.perf_counter()
+
 import math
+import threading
 
 from gateway_addon import Adapter, Device, Property, Action, Database
 
+from .log import LogSystem
+from .metrics import MetricsRegistry
+from .persistence import PersistentStore
+from .sessions import SessionRecorder
+from .statistics import BrushingStatistics, today
+from . import drivers
+
 
 import asyncio
-import hashlib
+import functools
 import logging
 
-import bleak
-from bleak_retry_connector import BleakClient, BLEDevice, establish_connection
+from .connection import DISCONNECTED, CONNECTING, CONNECTED
+from .capture import CaptureWriter, capture_file_path
+from .identity import IdentityIndex, normalise_address
+from .controllers import ControllerSet, parse_controller_names
+from .proxy import ProxyHub, ProxyBackend
+
+# Bleak is only imported once the Bluetooth loop starts, so that the things are available sooner
+_IMPORT_TIME = time.perf_counter() - _IMPORT_START
 
 
 _TIMEOUT = 3
+_MAX_BRUSH_TIME_GOAL = 3600 # seconds
+_SHUTDOWN_TIMEOUT = 1 # seconds
 
 _CONFIG_PATHS = [
     os.path.join(os.path.expanduser('~'), '.webthings', 'config'),
@@ -33,45 +50,116 @@ if 'WEBTHINGS_HOME' in os.environ:
 _LOGGER = logging.getLogger(__name__)
 
 
+_DETECTION_QUEUE_SIZE = 1000
+
+# Smaller changes than this are not sent to the controller
+_PROPERTY_DEADBANDS = {
+    'battery': 2,
+}
+
+# Minimum seconds between updates of quickly changing properties. Held back values are sent once the session ends.
+_MIN_UPDATE_INTERVALS = {
+    'brush_time': 1,
+    'sector_time': 5,
+    'pressure': 0.5,
+    'pressure_state': 0.5,
+}
+
+_POLL_INTERVAL = 1 # seconds
+_MAX_POLL_BACKOFF = 60 # seconds
+_MAX_IDLE_POLL_INTERVAL = 300 # seconds
+_SUSPEND_POLLING_AFTER = 120 # seconds without seeing a toothbrush
+
+_METRICS_INTERVAL = 60 # seconds between metrics snapshots
+_IDLE_LINGER = 30 # seconds to stay connected to a toothbrush that is not being used
+_LAST_VALUES_WRITE_DELAY = 30 # seconds. The last known values are only needed after a restart, so they are written lazily.
+
+# Seconds that the values that only hold while brushing stay valid without new data from the toothbrush. After that they
+# are cleared, so that a toothbrush that went out of range mid-session isn't shown as brushing forever.
+_DATA_TTLS = {
+    'brushing': 60,
+    'pressure': 60,
+    'pressure_state': 60,
+    'sector': 60,
+    'sector_time': 60,
+}
+_STALE_DATA_TIMEOUT = 60 # seconds without any data before a toothbrush thing is shown as disconnected
+
+# The property values that come from the toothbrush itself. The last known ones are shown again right after a restart.
+_LAST_VALUE_PROPERTIES = ('mode', 'brushing', 'brush_time', 'goal_reached', 'pressure', 'pressure_state', 'sector', 'sector_time', 'battery')
+
+
 
 class ToothbrushAdapter(Adapter):
     """Adapter for Toothbrush"""
 
-    def __init__(self, verbose=True):
+    def __init__(self, verbose=True, backend=None):
         """
         Initialize the object.
 
         verbose -- whether or not to enable verbose logging
+        backend -- the Bluetooth backend to use. By default that is bleak, which talks to real toothbrushes.
         """
+        self.startup_start = time.perf_counter()
+        self.startup_timing = {'imports':round(_IMPORT_TIME, 3)} # seconds after the start of init that each phase was reached
         #print("Initialising Toothbrush")
         self.pairing = False
         self.name = self.__class__.__name__
         self.addon_name = 'toothbrush'
-        Adapter.__init__(self, 'toothbrush', 'toothbrush', verbose=verbose)
+        super().__init__('toothbrush', 'toothbrush', verbose=verbose)
         #print("Adapter ID = " + self.get_id())
 
         
 
         self.DEBUG = True
+        self.log = LogSystem(self.DEBUG)
         
         self.continuous_scanning = True
+        self.passive_mode = True # decode the advertisements instead of connecting to the toothbrushes
+        self.live_notifications = True # subscribe to GATT notifications while a toothbrush is in use
+        self.record_traffic = False # write all Bluetooth traffic to a capture file, to reproduce problems later
+        self.capture = None
         self.brushing = False
         
-        self.oralb_toothbrushes = {} # holds the Bleak BLE objects
+        self.oralb_toothbrushes = {} # holds the connection to each toothbrush, of any brand
+        self.poll_tasks = {} # holds the asyncio task that polls each toothbrush
+        self.max_connections = 3 # per controller, as Bluetooth controllers can only hold a few connections at once
+        self.idle_linger = _IDLE_LINGER # seconds to stay connected once a toothbrush is no longer used
+        self.controller_names = [] # the Bluetooth controllers to scan and connect with. Empty for the default one.
+        self.controllers = None
+        self.proxy_port = 0 # remote Bluetooth proxies can connect on this port. 0 to disable.
+        self.proxy_key = ''
+        self.proxy_hub = None
+        self.backend = backend # if None, bleak is used once the Bluetooth loop starts
+        
+        self.property_deadbands = dict(_PROPERTY_DEADBANDS)
+        self.min_update_intervals = dict(_MIN_UPDATE_INTERVALS)
+        self.data_ttls = dict(_DATA_TTLS)
+        self.stale_data_timeout = _STALE_DATA_TIMEOUT
+        
+        self.running = False
+        self.shut_down = False
+        self.shutdown_lock = threading.Lock() # the gateway and a signal can both ask the add-on to stop
+        self.loop = None # the asyncio loop that runs the Bluetooth tasks
+        self.bluetooth_thread = None
+        self.bluetooth_tasks = []
         
         self.devices = {} # holds Webthings things
         
         self.persistent_data = {'toothbrushes':{}} # mainly stores the mac address of known toothbrushes
         
         self.last_time_scanned = 0
-        
-        first_run = False
+        self.seen_devices = {} # last seen time and RSSI of every BLE address the scanner has picked up
+        self.start_time = time.time()
         
         # Paths
         
         self.addon_path = os.path.join(self.user_profile['addonsDir'], self.addon_name)
         self.data_dir_path = os.path.join(self.user_profile['dataDir'], self.addon_name)
         self.persistence_file_path = os.path.join(self.data_dir_path, 'persistence.json')
+        self.recent_events_file_path = os.path.join(self.data_dir_path, 'recent_events.log')
+        self.captures_dir_path = os.path.join(self.data_dir_path, 'captures')
+        self.metrics = MetricsRegistry(os.path.join(self.data_dir_path, 'metrics.json'))
 
         try:
             #print("self.persistence_file_path: ", self.persistence_file_path)
@@ -82,17 +170,23 @@ class ToothbrushAdapter(Adapter):
                 print("failed to create data dir: ", ex)
         
         
-        try:
-            #print("self.persistence_file_path: " + str(self.persistence_file_path))
-            with open(self.persistence_file_path) as f:
-                self.persistent_data = json.load(f)
-                if self.DEBUG:
-                    print("Persistence data was loaded succesfully.")
-                
-        except Exception as ex:
-            first_run = True
-            print("Could not load persistent data (if you just installed the add-on then this is normal). " + str(ex))
-            self.persistent_data = {'toothbrushes':{}}
+        self.session_recorder = SessionRecorder(self.data_dir_path, self.DEBUG)
+        
+        self.persistence = PersistentStore(self.persistence_file_path, {'toothbrushes':{}}, self.DEBUG)
+        self.persistent_data = self.persistence.load()
+        self.last_values = PersistentStore(os.path.join(self.data_dir_path, 'last_values.json'), {}, self.DEBUG, _LAST_VALUES_WRITE_DELAY)
+        self.last_values.load()
+        self.startup_phase('persistent_data')
+        if not 'toothbrushes' in self.persistent_data:
+            self.persistent_data['toothbrushes'] = {}
+        
+        # Match advertisements to things by address. Things that were created twice for the same toothbrush are dropped.
+        self.identities = IdentityIndex(self.persistent_data['toothbrushes'])
+        for toothbrush_thing_id in self.identities.duplicates:
+            print("removing duplicate toothbrush from persistent data: ", toothbrush_thing_id)
+            del self.persistent_data['toothbrushes'][toothbrush_thing_id]
+        if self.identities.duplicates:
+            self.save_persistent_data()
         
         
         #if not 'token' in self.persistent_data:
@@ -103,6 +197,19 @@ class ToothbrushAdapter(Adapter):
             self.add_from_config()
         except Exception as ex:
             print("Error loading config: " + str(ex))
+        self.log.set_debug(self.DEBUG)
+        self.persistence.debug = self.DEBUG
+        self.session_recorder.debug = self.DEBUG
+        self.last_values.debug = self.DEBUG
+        
+        if self.record_traffic:
+            try:
+                if not os.path.isdir(self.captures_dir_path):
+                    os.mkdir(self.captures_dir_path)
+                self.capture = CaptureWriter(capture_file_path(self.captures_dir_path))
+                print("Recording Bluetooth traffic to: " + str(self.capture.file_path))
+            except Exception as ex:
+                print("Error: could not start recording Bluetooth traffic: " + str(ex))
 
 
 
@@ -112,28 +219,27 @@ class ToothbrushAdapter(Adapter):
                 
                 toothbrush_title = 'Toothbrush'
                 try:
-                    if 'name' in details.keys():
+                    if details.get('name'):
                         toothbrush_title = details['name']
                 except:
                     print("no name in toothbrush persistant data: ", details)
                 
                 self.devices[toothbrush_thing_id] = ToothbrushDevice(self, toothbrush_thing_id, toothbrush_title)
                 self.handle_device_added(self.devices[toothbrush_thing_id])
-                self.devices[toothbrush_thing_id].connected = True
-                self.devices[toothbrush_thing_id].connected_notify(True)
+                # Only connected once the toothbrush has been heard from, unless the last known data is still recent
+                self.devices[toothbrush_thing_id].update_connected(force=True)
                 if self.DEBUG:
                     print("created toothbrush thing with id: ", toothbrush_thing_id)
                     
             except Exception as ex:
                 if self.DEBUG:
                     print("Error creating toothbrush thing: " + str(ex))
-            
+        self.startup_phase('things')
         
         
         
         
-        self.running = True
-        asyncio.run(self.asyncio_main())
+        self.start_bluetooth()
         
         
         
@@ -177,6 +283,7 @@ class ToothbrushAdapter(Adapter):
         # {'brush_time': 2, 'battery': 97, 'status': 'IDLE', 'mode': 'OFF', 'sector': 'SECTOR_1', 'sector_time': 6}
         
 
+        self.startup_phase('init')
         if self.DEBUG:
             print("End of ToothbrushAdapter init process")
 
@@ -185,262 +292,559 @@ class ToothbrushAdapter(Adapter):
     #asyncio.run(oralb_main())
     
     async def oralb_main(self):
+        """Supervise a polling task for every known Oral-B toothbrush, so that one slow toothbrush can't hold up the others."""
         #print("self.running: ", self.running)
+        statistics_day = today()
+        metrics_time = time.time()
         while self.running:
             
-            await asyncio.sleep(1)
+            if time.time() - metrics_time > _METRICS_INTERVAL:
+                metrics_time = time.time()
+                await self.write_metrics()
             
-            try:
-                oralb_keys = self.oralb_toothbrushes.keys()
-                
-                #for short_hash, oralb_device in self.oralb_toothbrushes.items():
-                for toothbrush_thing_id in oralb_keys:
-                
-                
+            if self.capture != None:
+                self.capture.flush()
+            
+            # Once a day, let old sessions drop out of the brushing statistics
+            if today() != statistics_day:
+                statistics_day = today()
+                for device in list(self.devices.values()):
                     try:
-                        if toothbrush_thing_id in self.oralb_toothbrushes.keys():
-                            
-                            oralb_device = self.oralb_toothbrushes[toothbrush_thing_id]
-                            oralb_data = await oralb_device.gatherdata()
-                            if self.DEBUG:
-                                print("got Oral-B toothbrush data: ", oralb_data)
-                
-                            if oralb_data and "battery" in oralb_data.keys() and "brush_time" in oralb_data.keys():
+                        device.refresh_statistics()
+                    except Exception as ex:
+                        _LOGGER.warning("caught error refreshing brushing statistics: %s", ex)
+            
+            # Clear what the toothbrushes haven't confirmed for a while
+            now = time.time()
+            for device in list(self.devices.values()):
+                try:
+                    device.expire_stale_data(now)
+                except Exception as ex:
+                    _LOGGER.warning("caught error expiring stale data: %s", ex, extra={'device':device.id})
+            self.end_brushing_sessions(now)
+            
+            try:
+                for toothbrush_thing_id in list(self.oralb_toothbrushes.keys()):
+                    poll_task = self.poll_tasks.get(toothbrush_thing_id)
+                    if poll_task == None or poll_task.done():
+                        if poll_task != None and not poll_task.cancelled() and poll_task.exception() != None:
+                            _LOGGER.warning("polling task of %s crashed, restarting it: %s", toothbrush_thing_id, poll_task.exception(), extra={'device':toothbrush_thing_id})
+                        self.poll_tasks[toothbrush_thing_id] = asyncio.create_task(self.poll_toothbrush(toothbrush_thing_id))
                 
-                                try:
-                            
-                                    if not toothbrush_thing_id in self.devices.keys():
-                                        if self.DEBUG:
-                                            print("this toothbrush does not have a thing yet. Creating it now.")
-                                
-                                        self.devices[toothbrush_thing_id] = ToothbrushDevice(self, toothbrush_thing_id, 'toothbrush')
-                                        self.handle_device_added(self.devices[toothbrush_thing_id])
-                                        self.devices[toothbrush_thing_id].connected = True
-                                        self.devices[toothbrush_thing_id].connected_notify(True)
-                                
-                                    if not toothbrush_thing_id in self.devices.keys():
-                                        if self.DEBUG:
-                                            print("Error, thing still does not exist!")
-                                        break
-                                    
-                                    
-                                    privacy = False
-                                    brush_time_goal = None
-
-                                    if 'privacy' in self.persistent_data['toothbrushes'][toothbrush_thing_id].keys() and self.persistent_data['toothbrushes'][toothbrush_thing_id]['privacy'] == True:
-                                        privacy = True
-                                        if self.DEBUG:
-                                            print("privacy preference found in persistent data: ", privacy)
-                                        
-                                    if 'brush_time_goal' in self.persistent_data['toothbrushes'][toothbrush_thing_id].keys() and str(type(self.persistent_data['toothbrushes'][toothbrush_thing_id]['brush_time_goal'])) == "<class 'int'>":
-                                        if self.persistent_data['toothbrushes'][toothbrush_thing_id]['brush_time_goal'] > 3:
-                                            brush_time_goal = self.persistent_data['toothbrushes'][toothbrush_thing_id]['brush_time_goal']
-                                            if self.DEBUG:
-                                                print("brush_time_goal has been set: ", brush_time_goal)
-                                    
-                                          
-                                    
-                                    
-                                    if privacy == True:
-                                        if int(oralb_data["battery"]) > 80:
-                                            self.devices[toothbrush_thing_id].properties['battery'].update( 100 )
-                                        #elif int(oralb_data["battery"]) < 60:
-                                        #    self.devices[toothbrush_thing_id].properties['battery'].update( math.floor(int(oralb_data["battery"])/10) * 10 )
-                                        else:
-                                            #self.devices[toothbrush_thing_id].properties['battery'].update( math.floor(int(oralb_data["battery"])/20) * 20 )
-                                            self.devices[toothbrush_thing_id].properties['battery'].update( math.floor(int(oralb_data["battery"])/10) * 10 )
-                                    else:
-                                        self.devices[toothbrush_thing_id].properties['battery'].update( int(oralb_data["battery"]) )
-                                    
-                                    
-                                    self.devices[toothbrush_thing_id].properties['mode'].update( str(oralb_data["mode"]) )
-                                    
-                                    
-                                    if privacy == True:
-                                        self.devices[toothbrush_thing_id].properties['brush_time'].update( None )
-                                    #elif str(oralb_data["mode"]) == "OFF":
-                                    #    self.devices[toothbrush_thing_id].properties['brush_time'].update( None )
-                                    elif oralb_data["brush_time"] != None:
-                                        if self.DEBUG:
-                                            print("brush time: ", int(oralb_data["brush_time"]))
-                                        self.devices[toothbrush_thing_id].properties['brush_time'].update( int(oralb_data["brush_time"]) )
-                                    
-                                    
-                                    if str(type(brush_time_goal)) == "<class 'int'>" and brush_time_goal <= 2:
-                                        if self.DEBUG:
-                                            print("brush goal too small: ", brush_time_goal)
-                                        self.devices[toothbrush_thing_id].properties['goal_reached'].update( None )
-                                    elif int(oralb_data["brush_time"]) >= 3 and int(oralb_data["brush_time"]) < brush_time_goal: 
-                                        if self.DEBUG:
-                                            print("brush time is bigger than  and smaller than the goal, setting goal_reached to false: ", brush_time_goal)
-                                        self.devices[toothbrush_thing_id].properties['goal_reached'].update( False )
-                                    elif int(oralb_data["brush_time"]) > 4:
-                                        if brush_time_goal and int(oralb_data["brush_time"]) >= brush_time_goal:
-                                            if self.DEBUG:
-                                                print("brush goal reached: ", brush_time_goal)
-                                            self.devices[toothbrush_thing_id].properties['goal_reached'].update( True )
-                                            
-                                    
-                                    if privacy == True:
-                                        self.devices[toothbrush_thing_id].properties['brushing'].update( None )
-                                    elif oralb_data["status"] == "IDLE":
-                                        self.devices[toothbrush_thing_id].properties['brushing'].update( False )
-                                    elif oralb_data["status"] == "RUN":
-                                        self.devices[toothbrush_thing_id].properties['brushing'].update( True )
-                                    else:
-                                        self.devices[toothbrush_thing_id].properties['brushing'].update( None )
+                # Stop polling toothbrushes that have been removed
+                for toothbrush_thing_id in list(self.poll_tasks.keys()):
+                    if not toothbrush_thing_id in self.oralb_toothbrushes:
+                        self.poll_tasks[toothbrush_thing_id].cancel()
+                        del self.poll_tasks[toothbrush_thing_id]
                         
-                                    try:
-                                        if privacy == True:
-                                            self.devices[toothbrush_thing_id].properties['sector'].update( None )
-                                        elif "_" in oralb_data["sector"]:
-                                            sector = int(oralb_data["sector"].split("_",1)[1])
-                                            self.devices[toothbrush_thing_id].properties['sector'].update( sector )
-                                    except Exception as ex:
-                                        if self.DEBUG:
-                                            print("caught error updating Oral-B thing's sector: ", ex)
-                                            
-                                    try:
-                                        if privacy == True:
-                                            self.devices[toothbrush_thing_id].properties['sector_time'].update( None )
-                                        else:
-                                            self.devices[toothbrush_thing_id].properties['sector_time'].update( int(oralb_data["sector_time"]) )
-                                    except Exception as ex:
-                                        if self.DEBUG:
-                                            print("caught error updating Oral-B thing's sector time: ", ex)
-                
-                                    try:
-                                        print("----oralb_data[pressure]:", oralb_data["pressure"])
-                                        if privacy == False and oralb_data["pressure"] != None:
-                                            self.devices[toothbrush_thing_id].properties['pressure'].update( int(oralb_data["pressure"]) )
-                                    except Exception as ex:
-                                        if self.DEBUG:
-                                            print("caught error updating Oral-B thing's pressure: ", ex)
-                
-                                except Exception as ex:
-                                    if self.DEBUG:
-                                        print("caught general error updating Oral-B thing: ", ex)
-                                        
-                            else:
-                                if self.DEBUG:
-                                    print("invalid Oral-B data")
-                                    
-                    except Exception as ex:
-                        if self.DEBUG:
-                            print("caught error handling gatherData: ", ex)
             except Exception as ex:
-                if self.DEBUG:
-                    print("caught error during gatherData loop: ", ex)        
+                _LOGGER.warning("caught error during gatherData loop: %s", ex)
             
+            await asyncio.sleep(1)
+        
+        for poll_task in self.poll_tasks.values():
+            poll_task.cancel()
+        self.poll_tasks = {}
             
-        if self.DEBUG:
-            print("Asyncio Oral-B main loop ended")
+        _LOGGER.debug("Asyncio Oral-B main loop ended")
     
     
+    def end_brushing_sessions(self, now):
+        """End the brushing sessions that didn't resume in time, or whose toothbrush stopped sending data."""
+        try:
+            for toothbrush_thing_id, session_summary in self.session_recorder.expire(now, self.stale_data_timeout).items():
+                device = self.devices.get(toothbrush_thing_id)
+                if device != None:
+                    device.add_brushing_session(session_summary, device.settings.goal())
+        except Exception as ex:
+            _LOGGER.warning("caught error ending brushing sessions: %s", ex)
     
     
+    def startup_phase(self, phase):
+        """Note how long it took to get to a phase of starting up, the first time it is reached."""
+        if not phase in self.startup_timing:
+            self.startup_timing[phase] = round(time.perf_counter() - self.startup_start, 3)
+            _LOGGER.info("startup: %s after %s seconds", phase, self.startup_timing[phase])
     
-    async def toothbrush_scanner(self):
-        
-        if self.DEBUG:
-            print("in toothbrush_scanner. self.running: ", self.running)
-        
-        async def oralb_discover():
-            """Start looking for an OralB toothbrush."""
     
-            found_oralb_toothbrushes = []
-            try:
-                #discovered_devices = await bleak.BleakScanner.discover(return_adv=True)
-                discovered_devices = await bleak.BleakScanner.discover()
+    def metrics_snapshot(self):
+        """Get the performance metrics of all toothbrushes, plus the gateway wide connection load."""
+        extra = {'connection_slots':self.max_connections * max(len(self.controller_names), 1), 'startup':self.startup_timing}
+        if self.controllers != None:
+            extra['waiting_for_connection_slot'] = self.controllers.waiting
+            extra['controllers'] = self.controllers.snapshot()
+        return self.metrics.snapshot(extra)
     
-                #if self.DEBUG:
-                #    print('discovered devices: ', len(discovered_devices))
-                
-                for discovered_device in discovered_devices:
-                    if discovered_device.name and discovered_device.name == "Oral-B Toothbrush":
-                        if self.DEBUG:
-                            print("found Oral B toothbrush: ", discovered_device)
-                        #return device
-                        found_oralb_toothbrushes.append(discovered_device)
-                #print("No Oral-B toothbrush detected")
+    
+    async def write_metrics(self):
+        """Write a metrics snapshot to disk without blocking the event loop."""
+        snapshot = self.metrics_snapshot()
+        await asyncio.get_running_loop().run_in_executor(None, self.metrics.write, snapshot)
+    
+    
+    async def poll_toothbrush(self, toothbrush_thing_id):
+        """Keep polling a single toothbrush, as often as its current state calls for."""
+        scheduler = PollScheduler()
+        delay = _POLL_INTERVAL
+        
+        oralb_device = self.oralb_toothbrushes.get(toothbrush_thing_id)
+        if oralb_device == None:
+            return
         
+        try:
+            while self.running and self.oralb_toothbrushes.get(toothbrush_thing_id) is oralb_device:
+                    
+                await oralb_device.sleep(delay)
+                delay = _POLL_INTERVAL
+                
+                try:
+                    # Don't waste radio time on a toothbrush that is out of range. The scanner will wake it up again.
+                    if not self.toothbrush_in_range(oralb_device):
+                        _LOGGER.debug("toothbrush has not been seen for a while, suspending polling: %s", toothbrush_thing_id)
+                        oralb_device.suspended = True
+                        await oralb_device.sleep(None)
+                        oralb_device.suspended = False
+                        scheduler.reset()
+                        _LOGGER.debug("toothbrush was seen again, resuming polling: %s", toothbrush_thing_id)
+                        continue
+                    
+                    oralb_data = None
+                    
+                    # In connectionless mode the advertisements already deliver everything except the battery level
+                    if self.passive_mode and oralb_device.advertisement_is_fresh():
+                        if oralb_device.battery_poll_is_due():
+                            oralb_data = await oralb_device.gatherdata(oralb_device.decoder.BATTERY_CHARACTERISTICS)
+                    
+                    # During a brushing session the toothbrush pushes its data through notifications
+                    elif oralb_device.notifying:
+                        if oralb_device.result.status == "RUN":
+                            if oralb_device.battery_poll_is_due():
+                                oralb_data = await oralb_device.gatherdata(oralb_device.decoder.BATTERY_CHARACTERISTICS)
+                        else:
+                            _LOGGER.debug("brushing session ended, stopping notifications for: %s", toothbrush_thing_id)
+                            await oralb_device.stop_notifications()
+                            oralb_data = await oralb_device.gatherdata()
+                    
+                    else:
+                        oralb_data = await oralb_device.gatherdata()
+                        if self.live_notifications and oralb_data != None and oralb_data.status == "RUN":
+                            _LOGGER.debug("brushing session started, subscribing to notifications for: %s", toothbrush_thing_id)
+                            await oralb_device.start_notifications( functools.partial(self.update_toothbrush_thing, toothbrush_thing_id) )
+                    
+                    if oralb_data == None:
+                        delay = scheduler.next_delay(oralb_device.result.status, True)
+                    else:
+                        delay = scheduler.next_delay(oralb_device.result.status, oralb_device.last_poll_succeeded)
+                        if not oralb_device.last_poll_succeeded:
+                            _LOGGER.debug("could not poll toothbrush %s, retrying in %s seconds", toothbrush_thing_id, delay)
+                            continue
+                        
+                        _LOGGER.debug("got %s toothbrush data: %s", oralb_device.brand, oralb_data)
+                        
+                        self.update_toothbrush_thing(toothbrush_thing_id, oralb_data)
+                    
+                    # Hold on to the connection during a brushing session. Once the toothbrush has been idle for a while,
+                    # or if other toothbrushes are waiting for a connection slot, free it up again.
+                    if oralb_device.result.status == "RUN":
+                        oralb_device.last_active_time = time.time()
+                    elif oralb_device.is_connected() and not oralb_device.notifying:
+                        if self.controllers.waiting > 0 or oralb_device.idle_time() >= self.idle_linger:
+                            _LOGGER.debug("toothbrush is idle, disconnecting until its next advertisement: %s", toothbrush_thing_id)
+                            await oralb_device.release_connection()
+                            
+                            # Connect again once the toothbrush advertises, but not sooner than the next poll would have been
+                            oralb_device.parked_until = time.time() + delay
+                            await oralb_device.sleep(None)
+                            oralb_device.parked_until = None
+                            delay = 0
+                            
+                except Exception as ex:
+                    _LOGGER.warning("caught error handling gatherData: %s", ex, extra={'device':toothbrush_thing_id})
         
+        finally:
+            # Whether the toothbrush was removed, or this task was cancelled or crashed, its connection and
+            # connection slot must not be left behind
+            try:
+                await oralb_device.disconnect()
             except Exception as ex:
-                if self.DEBUG:
-                    print("caught error while doing bluetooth scan: ", ex)
+                _LOGGER.warning("caught error disconnecting from toothbrush: %s", ex, extra={'device':toothbrush_thing_id})
+        
+        _LOGGER.debug("polling task ended for: %s", toothbrush_thing_id)
     
-            return found_oralb_toothbrushes
-            
-            
-            
-        # MAIN SCANNER LOOP
-        #print("self.running: ", self.running)
-        while self.running:
-            
-            await asyncio.sleep(1)
-            
-            if self.pairing or self.continuous_scanning:
-                if self.pairing and self.DEBUG:
-                    print("toothbrush_scanner: currently in pairing mode")
-                
-                found_oralb_devices = await oralb_discover()
+    
+    def toothbrush_in_range(self, oralb_device):
+        """A toothbrush is in range if it is connected, or if the scanner has seen it recently."""
+        if oralb_device.client != None and oralb_device.client.is_connected:
+            return True
+        if oralb_device.ble_device == None:
+            return False
+        seen = self.seen_devices.get(normalise_address(oralb_device.ble_device.address))
+        return seen != None and time.time() - seen['last_seen'] < _SUSPEND_POLLING_AFTER
+    
+    
+    
+    def update_toothbrush_thing(self, toothbrush_thing_id, oralb_data, now=None):
+        """Apply the decoded Oral-B data to the properties of a toothbrush thing.
         
-                if found_oralb_devices:
-                    if self.DEBUG:
-                        print("found Oral-B BLE devices: ", found_oralb_devices)
+        now -- when the data was received, if that wasn't just now. Used when replaying a capture.
+        """
+        if oralb_data != None:
+
+            try:
+        
+                if not toothbrush_thing_id in self.devices.keys():
+                    _LOGGER.info("this toothbrush does not have a thing yet. Creating it now: %s", toothbrush_thing_id)
             
-                    h = hashlib.new('sha256')
+                    self.devices[toothbrush_thing_id] = ToothbrushDevice(self, toothbrush_thing_id, 'toothbrush')
+                    self.handle_device_added(self.devices[toothbrush_thing_id])
             
-                    for oralb_device in found_oralb_devices:
-                        #print("- name: ", oralb_device.name)
-                        #print("oralb_device: ", oralb_device)
-                        #print("dir oralb_device: ", dir(oralb_device))
-                        #print("- address: ", oralb_device.address)
-                        #print("- details: ", oralb_device.details)
-                        #print("- metadata: ", oralb_device.metadata)
-                        #print("- AdvertisementData: ", oralb_device.AdvertisementData)
-                        #print("- AdvertisementData.rssi: ", oralb_device.AdvertisementData.rssi)
+                if not toothbrush_thing_id in self.devices.keys():
+                    _LOGGER.error("Error, thing still does not exist: %s", toothbrush_thing_id)
+                    return
                 
-                        h.update(str(oralb_device.address).encode())
                 
-                        unique_hash = str(h.hexdigest())
-                        short_hash = 'toothbrush_' + unique_hash[-6:]
+                settings = self.devices[toothbrush_thing_id].settings
+                privacy = settings.privacy
+                brush_time_goal = settings.goal()
                 
-                        #print(" - address hash: ", unique_hash)
-                        #print(" - short hash: ", short_hash)
                 
+                # Keep a history of the brushing sessions, unless the user prefers privacy
+                if privacy == False:
+                    session_summary = self.session_recorder.record(toothbrush_thing_id, oralb_data, now)
+                    if session_summary != None:
+                        self.devices[toothbrush_thing_id].add_brushing_session(session_summary, brush_time_goal)
                 
-                        # Save Oral-B object for later use
-                        if not short_hash in self.oralb_toothbrushes:
-                            self.oralb_toothbrushes[short_hash] = OralB(oralb_device)
                 
+                # Collect all the new values first, so that the thing can send out only what really changed
+                values = {}
                 
-                        # Store data about this found toothbrush in persistent data
-                        if not short_hash in self.persistent_data['toothbrushes']:
-                            self.persistent_data['toothbrushes'][short_hash] = {
-                                        'name':oralb_device.name,
-                                        'address':oralb_device.address,
-                                        'hash':unique_hash,
-                                        'short_hash':short_hash,
-                                        'brand':'oralb',
-                                        'first_seen':time.time(),
-                                        'last_seen':time.time(),
-                                        'privacy':False,
-                                        'brush_time_goal':0
-                                    }
-                    
-                            self.save_persistent_data()
+                if oralb_data.battery == None:
+                    pass # Not known yet. Advertisements do not contain the battery level.
+                elif privacy == True:
+                    if int(oralb_data.battery) > 80:
+                        values['battery'] = 100
+                    #elif int(oralb_data.battery) < 60:
+                    #    values['battery'] = math.floor(int(oralb_data.battery)/10) * 10
+                    else:
+                        #values['battery'] = math.floor(int(oralb_data.battery)/20) * 20
+                        values['battery'] = math.floor(int(oralb_data.battery)/10) * 10
+                else:
+                    values['battery'] = int(oralb_data.battery)
                 
-            
-        if self.DEBUG:
-            print("Asyncio Oral-B scanner loop ended")
+                
+                values['mode'] = str(oralb_data.mode)
+                
+                
+                if privacy == True:
+                    values['brush_time'] = None
+                #elif str(oralb_data.mode) == "OFF":
+                #    values['brush_time'] = None
+                elif oralb_data.brush_time != None:
+                    values['brush_time'] = int(oralb_data.brush_time)
+                
+                
+                if brush_time_goal == None:
+                    values['goal_reached'] = None
+                elif oralb_data.brush_time == None:
+                    pass
+                elif oralb_data.brush_time >= 3 and oralb_data.brush_time < brush_time_goal: 
+                    values['goal_reached'] = False
+                elif oralb_data.brush_time > 4 and oralb_data.brush_time >= brush_time_goal:
+                    values['goal_reached'] = True
+                        
+                
+                if privacy == True:
+                    values['brushing'] = None
+                elif oralb_data.status == "IDLE" or oralb_data.status == "PAUSE":
+                    values['brushing'] = False
+                elif oralb_data.status == "RUN":
+                    values['brushing'] = True
+                else:
+                    values['brushing'] = None
+    
+                try:
+                    if privacy == True:
+                        values['sector'] = None
+                    elif oralb_data.sector != None and oralb_data.sector.startswith("SECTOR_"):
+                        values['sector'] = int(oralb_data.sector.split("_",1)[1])
+                    else:
+                        values['sector'] = None
+                except Exception as ex:
+                    _LOGGER.warning("caught error updating Oral-B thing's sector: %s", ex, extra={'device':toothbrush_thing_id})
+                        
+                try:
+                    if privacy == True or oralb_data.sector_time == None: # not every brand reports sectors
+                        values['sector_time'] = None
+                    else:
+                        values['sector_time'] = int(oralb_data.sector_time)
+                except Exception as ex:
+                    _LOGGER.warning("caught error updating Oral-B thing's sector time: %s", ex, extra={'device':toothbrush_thing_id})
+                
+                if privacy == False and oralb_data.pressure != None:
+                    values['pressure'] = int(oralb_data.pressure)
+                if privacy == False and oralb_data.pressure_state != None:
+                    values['pressure_state'] = oralb_data.pressure_state
+                
+                # Once the brushing session is over, don't hold anything back
+                self.devices[toothbrush_thing_id].update_properties(values, force=(oralb_data.status != "RUN"), now=now)
+                
+            except Exception as ex:
+                _LOGGER.warning("caught general error updating Oral-B thing: %s", ex, extra={'device':toothbrush_thing_id})
+                
+        else:
+            _LOGGER.debug("invalid Oral-B data")
+    
+    
+    
+    
+    
+    async def toothbrush_scanner(self):
+        """Run a long-lived BleakScanner on every controller and handle their detections as they stream in."""
+        
+        _LOGGER.debug("in toothbrush_scanner. self.running: %s", self.running)
+        
+        detection_queue = asyncio.Queue(maxsize=_DETECTION_QUEUE_SIZE)
+        
+        def detection_callback(controller, ble_device, advertisement_data):
+            try:
+                detection_queue.put_nowait((time.time(), ble_device, advertisement_data, controller))
+            except asyncio.QueueFull:
+                pass # the handler has fallen behind, newer advertisements will follow
+        
+        
+        async def scan(controller):
+            """Keep the scanner of a controller alive, restarting it if BlueZ drops it."""
+            while self.running:
+                try:
+                    async with self.backend.scanner(functools.partial(detection_callback, controller), controller):
+                        _LOGGER.debug("toothbrush_scanner: scanner started on controller: %s", controller)
+                        self.startup_phase('scanning')
+                        while self.running:
+                            await asyncio.sleep(1)
+                            
+                except Exception as ex:
+                    _LOGGER.warning("caught error while doing bluetooth scan on controller %s: %s", controller, ex)
+                    self.controllers.fail(controller)
+                    await asyncio.sleep(5)
+        
+        
+        scan_tasks = [asyncio.create_task(scan(controller)) for controller in self.controllers.names()]
+        
+        # MAIN SCANNER LOOP
+        try:
+            while self.running:
+                try:
+                    seen_time, ble_device, advertisement_data, controller = await asyncio.wait_for(detection_queue.get(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                
+                try:
+                    self.handle_detection(seen_time, ble_device, advertisement_data, controller)
+                except Exception as ex:
+                    _LOGGER.warning("caught error handling bluetooth detection: %s", ex)
+        finally:
+            # Stopping the scanner tasks also stops the BlueZ discovery sessions
+            for scan_task in scan_tasks:
+                scan_task.cancel()
+            await asyncio.gather(*scan_tasks, return_exceptions=True)
+        
+        _LOGGER.debug("Asyncio Oral-B scanner loop ended")
+    
+    
+    def handle_detection(self, seen_time, ble_device, advertisement_data, controller=None):
+        """Keep track of a detected BLE device, and handle it if it's an Oral-B toothbrush.
+        
+        controller -- the name of the Bluetooth controller that picked up the advertisement, None for the default one
+        """
+        
+        if self.capture != None:
+            self.capture.advertisement(seen_time, ble_device, advertisement_data)
+        
+        address = normalise_address(ble_device.address)
+        if address in self.seen_devices:
+            self.seen_devices[address]['last_seen'] = seen_time
+            self.seen_devices[address]['rssi'] = advertisement_data.rssi
+        else:
+            self.seen_devices[address] = {'last_seen':seen_time, 'rssi':advertisement_data.rssi}
+        
+        driver = drivers.match(ble_device.name, advertisement_data.manufacturer_data, advertisement_data.service_uuids)
+        if driver == None:
+            return
+        self.startup_phase('first_detection')
+        
+        short_hash = self.identities.thing_id(address)
+        
+        if short_hash == None:
+            if not (self.pairing or self.continuous_scanning):
+                return
+            short_hash = self.add_toothbrush(seen_time, ble_device, address, driver.brand)
+        
+        oralb_device = self.oralb_toothbrushes.get(short_hash)
+        if oralb_device == None:
+            # The driver of a brand is only imported once a toothbrush of that brand shows up
+            oralb_device = driver.load()(ble_device, self.controllers, self.metrics.device(short_hash), self.backend)
+            oralb_device.capture = self.capture
+            oralb_device.connection_state_callback = functools.partial(self.update_connection_state, short_hash)
+            self.oralb_toothbrushes[short_hash] = oralb_device
+        oralb_device.set_ble_device(ble_device, controller, advertisement_data.rssi, seen_time)
+        oralb_device.metrics.increment('detections')
+        oralb_device.metrics.record_rssi(advertisement_data.rssi)
+        
+        # Being heard at all is enough to count as connected, also for brands that don't broadcast their state
+        device = self.devices.get(short_hash)
+        if device != None:
+            device.heard_from(seen_time)
+        
+        # Only some brands broadcast their state in the manufacturer specific data
+        advertised_data = advertisement_data.manufacturer_data.get(oralb_device.decoder.MANUFACTURER_ID)
+        
+        # Wake up the polling task if the toothbrush is back in range, or if a brushing session just started
+        if oralb_device.suspended:
+            oralb_device.wake()
+        elif oralb_device.parked_until != None and seen_time >= oralb_device.parked_until:
+            oralb_device.wake()
+        elif oralb_device.result.status != "RUN" and advertised_data != None:
+            if oralb_device.decoder.advertised_status(advertised_data) == "RUN":
+                oralb_device.wake()
+        
+        # Connectionless mode: the advertisement itself holds the brushing data
+        if self.passive_mode and advertised_data != None:
+            decode_start = time.perf_counter()
+            if oralb_device.parse_advertisement(advertised_data):
+                oralb_device.metrics.observe('decode', time.perf_counter() - decode_start)
+                oralb_device.metrics.record_sample(seen_time)
+                self.update_toothbrush_thing(short_hash, oralb_device.result, seen_time)
+    
+    
+    def update_connection_state(self, toothbrush_thing_id, state):
+        """Show whether the add-on is connected to a toothbrush."""
+        device = self.devices.get(toothbrush_thing_id)
+        if device != None:
+            device.update_properties({'connection':state}, force=True)
+    
+    
+    def add_toothbrush(self, seen_time, ble_device, address, brand):
+        """Give a newly found toothbrush an identity. Returns the id of its thing."""
+        
+        # Passive scans don't get the scan response, which is where the name usually is
+        name = ble_device.name or drivers.BRANDS[brand].names[0]
+        
+        # While pairing, a toothbrush that shows up with a new address is most likely a known one that was re-paired.
+        # That is only assumed once the scanner has had time to see all the toothbrushes that are in range.
+        if self.pairing and time.time() - self.start_time > _SUSPEND_POLLING_AFTER:
+            missing = self.identities.unseen(self.seen_devices, name, brand)
+            if len(missing) == 1:
+                toothbrush_thing_id = missing[0]
+                _LOGGER.info("toothbrush %s was re-paired, its new address is: %s", toothbrush_thing_id, address)
+                self.identities.move(toothbrush_thing_id, address)
+                if toothbrush_thing_id in self.oralb_toothbrushes:
+                    self.oralb_toothbrushes[toothbrush_thing_id].set_ble_device(ble_device)
+                self.save_persistent_data()
+                return toothbrush_thing_id
+        
+        _LOGGER.info("found %s toothbrush: %s (pairing: %s)", brand, ble_device, self.pairing)
+        
+        toothbrush_thing_id, unique_hash = self.identities.new_thing_id(address)
+        self.identities.add(toothbrush_thing_id, address)
+        
+        # Store data about this found toothbrush in persistent data
+        if not toothbrush_thing_id in self.persistent_data['toothbrushes']:
+            self.persistent_data['toothbrushes'][toothbrush_thing_id] = {
+                        'name':name,
+                        'address':address,
+                        'hash':unique_hash,
+                        'short_hash':toothbrush_thing_id,
+                        'brand':brand,
+                        'first_seen':seen_time,
+                        'last_seen':seen_time,
+                        'privacy':False,
+                        'brush_time_goal':0
+                    }
+            self.save_persistent_data()
+        
+        return toothbrush_thing_id
+    
+    
+    def start_backend(self):
+        """Set up the Bluetooth backend. This is where bleak gets imported, unless another backend was given."""
+        if self.backend == None:
+            from .ble_backend import BleakBackend
+            self.backend = BleakBackend()
+        
+        # Toothbrushes that are out of range can be reached through proxies on other machines
+        if self.proxy_port > 0 and self.proxy_hub == None and not self.proxy_key:
+            print("Error: a proxy key has to be set before Bluetooth proxies can connect")
+        elif self.proxy_port > 0 and self.proxy_hub == None:
+            self.proxy_hub = ProxyHub(self, self.proxy_port, self.proxy_key)
+            self.backend = ProxyBackend(self.backend, self.proxy_hub)
+        self.startup_phase('bluetooth_backend')
     
     
     async def asyncio_main(self):
-        await asyncio.gather(asyncio.create_task(self.oralb_main()), asyncio.create_task(self.toothbrush_scanner()))
+        self.start_backend()
+        self.controllers = ControllerSet(self.controller_names, self.max_connections)
+        for oralb_device in self.oralb_toothbrushes.values():
+            oralb_device.controllers = self.controllers
+        self.bluetooth_tasks = [asyncio.create_task(self.oralb_main()), asyncio.create_task(self.toothbrush_scanner())]
+        if self.proxy_hub != None:
+            self.bluetooth_tasks.append(asyncio.create_task(self.proxy_hub.serve()))
+        await asyncio.gather(*self.bluetooth_tasks, return_exceptions=True)
+        
+        # Don't leave any connections behind in BlueZ
+        disconnects = [oralb_device.disconnect() for oralb_device in list(self.oralb_toothbrushes.values())]
+        if disconnects:
+            await asyncio.gather(*disconnects, return_exceptions=True)
+        
         if self.DEBUG:
             print("Asyncio done")
     
+    
+    async def stop_tasks(self):
+        """Cancel the scanner and polling tasks. asyncio_main then disconnects from the toothbrushes."""
+        tasks = list(self.poll_tasks.values()) + self.bluetooth_tasks
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    
+    def start_bluetooth(self):
+        """Run the Bluetooth scanner and polling tasks on their own event loop in a background thread."""
+        if self.bluetooth_thread != None and self.bluetooth_thread.is_alive():
+            return
+        self.running = True
+        self.bluetooth_thread = threading.Thread(target=self.run_bluetooth_loop, name='toothbrush-bluetooth', daemon=True)
+        self.bluetooth_thread.start()
+    
+    
+    def run_bluetooth_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.asyncio_main())
+        except Exception as ex:
+            print("caught error in Bluetooth event loop: ", ex)
+        finally:
+            self.loop.close()
+            self.loop = None
+    
+    
+    def stop_bluetooth(self, timeout=_SHUTDOWN_TIMEOUT):
+        """Stop the Bluetooth tasks and wait (briefly) for the background thread to finish."""
+        self.running = False
+        
+        loop = self.loop
+        if loop != None and loop.is_running():
+            try:
+                future = asyncio.run_coroutine_threadsafe(self.stop_tasks(), loop)
+                future.result(timeout)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("stop_bluetooth: could not cleanly stop the Bluetooth tasks: ", ex)
+        
+        if self.bluetooth_thread != None:
+            self.bluetooth_thread.join(timeout)
+            self.bluetooth_thread = None
+    
 
 
 
@@ -458,7 +862,23 @@ class ToothbrushAdapter(Adapter):
             print("Shutting down Toothbrush addon")
         #self.devices['toothbrush_thing'].connected = False
         #self.devices['toothbrush_thing'].connected_notify(False)
-        self.running = False
+        self.shutdown()
+
+
+    def shutdown(self):
+        """Stop the Bluetooth tasks and save everything that is still pending. Shutting down more than once does nothing."""
+        with self.shutdown_lock:
+            if self.shut_down:
+                return
+            self.shut_down = True
+        
+        self.stop_bluetooth()
+        self.session_recorder.close_all()
+        self.persistence.close()
+        self.last_values.close()
+        self.metrics.write(self.metrics_snapshot())
+        if self.capture != None:
+            self.capture.close()
         
         
         for toothbrush_thing_id, thingy in self.devices.items():
@@ -469,7 +889,15 @@ class ToothbrushAdapter(Adapter):
                 self.devices[toothbrush_thing_id].connected_notify(False)
             except Exception as ex:
                 if self.DEBUG:
-                    print("unload: could not cleanly disconnect-notify toothbrush thing: ", ex)
+                    print("shutdown: could not cleanly disconnect-notify toothbrush thing: ", ex)
+        
+        self.log.close()
+
+
+    def dump_log(self):
+        """Write the most recent log events to a file in the data directory, to help diagnose problems."""
+        if self.log.dump(self.recent_events_file_path):
+            print("Recent events were written to: " + str(self.recent_events_file_path))
 
     def remove_thing(self, device_id):
         if self.DEBUG:
@@ -487,11 +915,16 @@ class ToothbrushAdapter(Adapter):
         
         
                 
+        self.identities.remove(device_id)
+        
         if device_id in self.oralb_toothbrushes.keys():
             del self.oralb_toothbrushes[device_id]
             if self.DEBUG:
                 print("Removed device from self.oralb_toothbrushes: ", device_id)
             
+        if self.last_values.data.pop(device_id, None) != None:
+            self.last_values.mark_dirty()
+        
         if device_id in self.persistent_data['toothbrushes'].keys():
             del self.persistent_data['toothbrushes'][device_id]
             self.save_persistent_data()
@@ -547,6 +980,102 @@ class ToothbrushAdapter(Adapter):
                 self.DEBUG = False
         except:
             print("Error loading debugging preference")
+        
+        # Connectionless mode
+        try:
+            if 'Connectionless mode' in config:
+                self.passive_mode = bool(config['Connectionless mode'])
+                if self.DEBUG:
+                    print("Connectionless mode is set to: " + str(self.passive_mode))
+        except:
+            print("Error loading connectionless mode preference")
+        
+        # Live updates while brushing
+        try:
+            if 'Live updates while brushing' in config:
+                self.live_notifications = bool(config['Live updates while brushing'])
+                if self.DEBUG:
+                    print("Live updates while brushing is set to: " + str(self.live_notifications))
+        except:
+            print("Error loading live updates preference")
+        
+        # Maximum connections
+        try:
+            if 'Maximum connections' in config:
+                if int(config['Maximum connections']) > 0:
+                    self.max_connections = int(config['Maximum connections'])
+                if self.DEBUG:
+                    print("Maximum connections is set to: " + str(self.max_connections))
+        except:
+            print("Error loading maximum connections preference")
+        
+        # Bluetooth controllers
+        try:
+            if 'Bluetooth controllers' in config:
+                self.controller_names = parse_controller_names(config['Bluetooth controllers'])
+                if self.DEBUG:
+                    print("Bluetooth controllers are set to: " + str(self.controller_names))
+        except:
+            print("Error loading Bluetooth controllers preference")
+        
+        # Idle connection time
+        try:
+            if 'Idle connection time' in config:
+                if int(config['Idle connection time']) >= 0:
+                    self.idle_linger = int(config['Idle connection time'])
+                if self.DEBUG:
+                    print("Idle connection time is set to: " + str(self.idle_linger))
+        except:
+            print("Error loading idle connection time preference")
+        
+        # Proxy port
+        try:
+            if 'Proxy port' in config:
+                if 0 <= int(config['Proxy port']) <= 65535:
+                    self.proxy_port = int(config['Proxy port'])
+                if self.DEBUG:
+                    print("Proxy port is set to: " + str(self.proxy_port))
+        except:
+            print("Error loading proxy port preference")
+        
+        # Proxy key
+        try:
+            if 'Proxy key' in config:
+                self.proxy_key = str(config['Proxy key']).strip()
+                if self.DEBUG:
+                    print("Proxy key is set: " + str(self.proxy_key != ''))
+        except:
+            print("Error loading proxy key preference")
+        
+        # Record Bluetooth traffic
+        try:
+            if 'Record Bluetooth traffic' in config:
+                self.record_traffic = bool(config['Record Bluetooth traffic'])
+                if self.DEBUG:
+                    print("Record Bluetooth traffic is set to: " + str(self.record_traffic))
+        except:
+            print("Error loading record Bluetooth traffic preference")
+        
+        # Stale data timeout
+        try:
+            if 'Stale data timeout' in config:
+                if int(config['Stale data timeout']) > 0:
+                    self.stale_data_timeout = int(config['Stale data timeout'])
+                    for name in self.data_ttls.keys():
+                        self.data_ttls[name] = self.stale_data_timeout
+                if self.DEBUG:
+                    print("Stale data timeout is set to: " + str(self.stale_data_timeout))
+        except:
+            print("Error loading stale data timeout preference")
+        
+        # Battery change threshold
+        try:
+            if 'Battery change threshold' in config:
+                self.property_deadbands['battery'] = int(config['Battery change threshold'])
+                if self.DEBUG:
+                    print("Battery change threshold is set to: " + str(self.property_deadbands['battery']))
+        except:
+            print("Error loading battery change threshold preference")
             
         
     #
@@ -554,25 +1083,12 @@ class ToothbrushAdapter(Adapter):
     #
 
     def save_persistent_data(self):
+        """Mark the persistent data as changed. It is written to disk in the background shortly after."""
         if self.DEBUG:
-            print("Toothbrush: Saving to persistence data store at path: " + str(self.persistence_file_path))
+            print("Toothbrush: persistent data changed, it will be saved to: " + str(self.persistence_file_path))
         
-        try:
-            if not os.path.isfile(self.persistence_file_path):
-                open(self.persistence_file_path, 'a').close()
-                if self.DEBUG:
-                    print("Created an empty persistence file")
-
-            with open(self.persistence_file_path) as f:
-                if self.DEBUG:
-                    print("saving persistent data: " + str(self.persistent_data))
-                json.dump( self.persistent_data, open( self.persistence_file_path, 'w+' ), indent=4 )
-                return True
-
-        except Exception as ex:
-            if self.DEBUG:
-                print("Error: could not store data in persistent store: " + str(ex) )
-            return False
+        self.persistence.mark_dirty()
+        return True
        
 
 
@@ -580,6 +1096,46 @@ class ToothbrushAdapter(Adapter):
 #  DEVICES
 #
 
+class ToothbrushSettings:
+    """The user's settings for a single toothbrush, checked once when they are loaded."""
+
+    __slots__ = ('privacy', 'brush_time_goal')
+
+    def __init__(self, record=None):
+        self.privacy = False
+        self.brush_time_goal = 0
+        
+        if record:
+            try:
+                self.privacy = bool(record.get('privacy', False))
+            except Exception as ex:
+                print("invalid privacy setting in persistent data: ", ex)
+            try:
+                self.brush_time_goal = ToothbrushSettings.valid_brush_time_goal(record.get('brush_time_goal', 0))
+            except Exception as ex:
+                print("invalid brush_time_goal setting in persistent data: ", ex)
+
+    @staticmethod
+    def valid_brush_time_goal(value):
+        if value == None:
+            return 0
+        return max(0, min(int(value), _MAX_BRUSH_TIME_GOAL))
+
+    def goal(self):
+        """The brush time goal in seconds, or None if no (sensible) goal has been set."""
+        if self.brush_time_goal > 3:
+            return self.brush_time_goal
+        return None
+
+    def save(self, record):
+        record['privacy'] = self.privacy
+        record['brush_time_goal'] = self.brush_time_goal
+
+    def __repr__(self):
+        return str({'privacy':self.privacy, 'brush_time_goal':self.brush_time_goal})
+
+
+
 class ToothbrushDevice(Device):
     """Toothbrush device type."""
 
@@ -605,7 +1161,17 @@ class ToothbrushDevice(Device):
         if self.adapter.DEBUG: 
             print("Toothbrush thing has been created.  ID, title: ", self.id, self.title)
 
+        self.settings = ToothbrushSettings(self.adapter.persistent_data['toothbrushes'].get(self.id))
+        if self.adapter.DEBUG: 
+            print("toothbrush settings: ", self.settings)
+
         self.properties = {}
+        self.pending_values = {} # values held back by the minimum interval between updates
+        self.last_update_times = {}
+        self.data_times = {} # when each property last got a value from the toothbrush, changed or not
+        self.last_data_time = 0
+        self.connected = False # until the toothbrush sends data
+        self.metrics = self.adapter.metrics.device(self.id)
         # BooleanProperty
         
         """
@@ -653,20 +1219,6 @@ class ToothbrushDevice(Device):
                         },
                         None)
                         
-        brush_time_goal = 0
-        try:
-            if self.adapter.persistent_data['toothbrushes'][self.id]:
-                if 'brush_time_goal' in self.adapter.persistent_data['toothbrushes'][self.id].keys() and str(type(self.adapter.persistent_data['toothbrushes'][self.id]['brush_time_goal'])) == "<class 'int'>":
-                    brush_time_goal = int(self.adapter.persistent_data['toothbrushes'][self.id]['brush_time_goal'])
-                    if self.adapter.DEBUG: 
-                        print("found brush_time_goal preference in persistent data: ", brush_time_goal)
-                        
-        except Exception as ex:
-            if self.adapter.DEBUG:
-                print("no brush_time_goal preference found in persistant data for toothbrush: ", self.id, ", error was: ", ex)
-        
-        
-        
         self.properties["brush_time_goal"] = ToothbrushProperty(
                         self,
                         "brush_time_goal",
@@ -675,9 +1227,9 @@ class ToothbrushDevice(Device):
                             'type': 'integer',
                             'readOnly': False,
                             'minimum':0,
-                            'maximum':3600,
+                            'maximum':_MAX_BRUSH_TIME_GOAL,
                         },
-                        brush_time_goal)
+                        self.settings.brush_time_goal)
         
         
         
@@ -704,6 +1256,16 @@ class ToothbrushDevice(Device):
                         },
                         None)
         
+        self.properties["pressure_state"] = ToothbrushProperty(
+                        self,
+                        "pressure_state",
+                        {
+                            "label": "Pressure state",
+                            'type': 'string',
+                            'readOnly': True,
+                        },
+                        None)
+        
         self.properties["sector"] = ToothbrushProperty(
                         self,
                         "sector",
@@ -738,22 +1300,6 @@ class ToothbrushDevice(Device):
                         },
                         None)
         
-        privacy_state = False
-        try:
-            if self.adapter.persistent_data['toothbrushes'][self.id]:
-                if 'privacy' in self.adapter.persistent_data['toothbrushes'][self.id].keys():
-                    if self.adapter.persistent_data['toothbrushes'][self.id]['privacy'] != None:
-                        privacy_state = bool(self.adapter.persistent_data['toothbrushes'][self.id]['privacy'])
-                        if self.adapter.DEBUG: 
-                            print("found privacy preference in persistent data: ", privacy_state)
-                        
-        except Exception as ex:
-            if self.adapter.DEBUG:
-                print("no privacy preference found in persistant data for toothbrush: ", self.id, ", error was: ", ex)
-        
-        if self.adapter.DEBUG:
-            print("initial privacy state of toothbrush: ", privacy_state)
-        
         self.properties["privacy"] = ToothbrushProperty(
                         self,
                         "privacy",
@@ -762,13 +1308,258 @@ class ToothbrushDevice(Device):
                             'type': 'boolean',
                             'readOnly': False,
                         },
-                        privacy_state)
+                        self.settings.privacy)
+        
+        self.properties["connection"] = ToothbrushProperty(
+                        self,
+                        "connection",
+                        {
+                            "label": "Connection",
+                            'type': 'string',
+                            'enum': [DISCONNECTED, CONNECTING, CONNECTED],
+                            'readOnly': True,
+                        },
+                        DISCONNECTED)
         
         
+        statistics_data = None
+        try:
+            if self.id in self.adapter.persistent_data['toothbrushes'] and 'statistics' in self.adapter.persistent_data['toothbrushes'][self.id]:
+                statistics_data = self.adapter.persistent_data['toothbrushes'][self.id]['statistics']
+        except Exception as ex:
+            if self.adapter.DEBUG:
+                print("no brushing statistics found in persistant data for toothbrush: ", self.id, ", error was: ", ex)
+        
+        self.statistics = BrushingStatistics(statistics_data)
+        
+        self.properties["average_brush_time_week"] = ToothbrushProperty(
+                        self,
+                        "average_brush_time_week",
+                        {
+                            "label": "Average brush time (7 days)",
+                            'type': 'integer',
+                            'readOnly': True,
+                        },
+                        self.statistics.average_brush_time_week)
+        
+        self.properties["average_brush_time_month"] = ToothbrushProperty(
+                        self,
+                        "average_brush_time_month",
+                        {
+                            "label": "Average brush time (30 days)",
+                            'type': 'integer',
+                            'readOnly': True,
+                        },
+                        self.statistics.average_brush_time_month)
+        
+        self.properties["goal_hit_rate"] = ToothbrushProperty(
+                        self,
+                        "goal_hit_rate",
+                        {
+                            "label": "Goal reached (30 days)",
+                            'type': 'integer',
+                            'readOnly': True,
+                            'unit':'percent',
+                            'minimum':0,
+                            'maximum':100,
+                        },
+                        self.statistics.goal_hit_rate)
+        
+        self.properties["sector_balance"] = ToothbrushProperty(
+                        self,
+                        "sector_balance",
+                        {
+                            "label": "Time per sector",
+                            'type': 'string',
+                            'readOnly': True,
+                        },
+                        self.statistics.sector_balance())
+        
+        self.properties["streak"] = ToothbrushProperty(
+                        self,
+                        "streak",
+                        {
+                            "label": "Streak",
+                            'type': 'integer',
+                            'readOnly': True,
+                            'unit':'days',
+                        },
+                        self.statistics.current_streak)
+        
+        # Show the last known values right away, instead of empty tiles until the toothbrush is reached again
+        self.restore_last_values()
         
         self.adapter.handle_device_added(self)
 
 
+    def restore_last_values(self):
+        last_values = self.adapter.last_values.data.get(self.id)
+        if last_values == None:
+            return
+        now = time.time()
+        times = last_values.get('times', {})
+        for name, value in last_values.get('values', {}).items():
+            prop = self.properties.get(name)
+            if prop == None:
+                continue
+            
+            # A brushing state from before the restart is only shown if it could still be true
+            data_time = times.get(name, 0)
+            if self.expires(name, value) and now - data_time > self.adapter.data_ttls[name]:
+                continue
+            
+            prop.value = value
+            prop.set_cached_value(value)
+            if value != None:
+                self.data_times[name] = data_time
+        self.last_data_time = max((times.get(name, 0) for name, value in last_values.get('values', {}).items() if value != None), default=0)
+
+
+    def update_connected(self, now=None, force=False):
+        """Show the thing as connected for as long as the toothbrush keeps sending data."""
+        if now == None:
+            now = time.time()
+        connected = now - self.last_data_time < self.adapter.stale_data_timeout
+        if force or connected != self.connected:
+            self.connected_notify(connected)
+
+
+    def heard_from(self, now):
+        """The toothbrush was detected, so it is still around, even if it didn't send new values."""
+        if now > self.last_data_time:
+            self.last_data_time = now
+        if not self.connected:
+            self.update_connected(now)
+
+
+    def expires(self, name, value):
+        """Whether a value can go stale. A toothbrush that stopped brushing stays that way until it says otherwise."""
+        if not name in self.adapter.data_ttls:
+            return False
+        return name != 'brushing' or value == True
+
+
+    def expire_stale_data(self, now):
+        """Clear the values that the toothbrush hasn't confirmed within their time to live."""
+        expired = {}
+        for name, ttl in self.adapter.data_ttls.items():
+            data_time = self.data_times.get(name)
+            if data_time != None and now - data_time > ttl and self.expires(name, self.properties[name].value):
+                expired[name] = None
+                del self.data_times[name]
+        
+        if expired:
+            _LOGGER.debug("Toothbrush thing %s has not sent new data, clearing: %s", self.id, list(expired))
+            self.update_properties(expired, force=True, now=now)
+        self.update_connected(now)
+
+
+    def remember_values(self, changed, now):
+        """Keep the latest values that came from the toothbrush, and when they arrived, for the next start."""
+        last_values = None
+        for prop, value in changed:
+            if prop.name in _LAST_VALUE_PROPERTIES:
+                if last_values == None:
+                    last_values = self.adapter.last_values.data.setdefault(self.id, {'values':{}, 'times':{}})
+                last_values['values'][prop.name] = value
+                last_values['times'][prop.name] = now
+        if last_values != None:
+            self.adapter.last_values.mark_dirty()
+
+
+    def save_settings(self):
+        """Store the settings of this toothbrush in the persistent data."""
+        if self.id in self.adapter.persistent_data['toothbrushes']:
+            self.settings.save(self.adapter.persistent_data['toothbrushes'][self.id])
+            self.adapter.save_persistent_data()
+        elif self.adapter.DEBUG:
+            print("Error, device not found in persistent data?")
+
+
+    def update_properties(self, values, force=False, now=None):
+        """Compare a snapshot of new property values with the current ones, and send out all the changes in one go.
+        
+        values -- dictionary of property names and their new values
+        force -- ignore the minimum interval between updates, and send out any values that were held back
+        now -- when the values were received, if that wasn't just now
+        """
+        if now == None:
+            now = time.time()
+        
+        # Keep track of how fresh the data from the toothbrush is, even if it doesn't change anything
+        fresh = False
+        for name, value in values.items():
+            if value != None and name in _LAST_VALUE_PROPERTIES:
+                self.data_times[name] = now
+                fresh = True
+        if fresh:
+            self.heard_from(now)
+        
+        # Values that were held back earlier get another chance, unless there is a newer value
+        snapshot = self.pending_values
+        snapshot.update(values)
+        self.pending_values = {}
+        
+        changed = []
+        for name, value in snapshot.items():
+            prop = self.properties.get(name)
+            if prop == None or value == prop.value:
+                continue
+            
+            deadband = self.adapter.property_deadbands.get(name)
+            if deadband and value != None and prop.value != None and abs(value - prop.value) < deadband:
+                continue
+            
+            interval = self.adapter.min_update_intervals.get(name)
+            if interval and not force and now - self.last_update_times.get(name, 0) < interval:
+                self.pending_values[name] = value
+                continue
+            
+            changed.append((prop, value))
+        
+        if not changed:
+            self.metrics.sample_time = None
+            return
+        
+        notify_start = time.perf_counter()
+        for prop, value in changed:
+            prop.value = value
+            prop.set_cached_value(value)
+            self.last_update_times[prop.name] = now
+        for prop, value in changed:
+            self.notify_property_changed(prop)
+        self.remember_values(changed, now)
+        self.metrics.observe('notify', time.perf_counter() - notify_start)
+        self.metrics.increment('updates', len(changed))
+        self.metrics.sample_handled()
+        
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Toothbrush thing %s changed: %s", self.id, {prop.name:value for prop, value in changed})
+
+
+    def add_brushing_session(self, summary, brush_time_goal):
+        """Update the brushing statistics with a session that just ended."""
+        self.statistics.add_session(summary, brush_time_goal)
+        if self.id in self.adapter.persistent_data['toothbrushes']:
+            self.adapter.persistent_data['toothbrushes'][self.id]['statistics'] = self.statistics.to_dict()
+            self.adapter.save_persistent_data()
+        self.update_statistics_properties()
+
+
+    def refresh_statistics(self):
+        """Called when the day changes, so that old days drop out of the averages and a broken streak resets."""
+        self.statistics.refresh()
+        self.update_statistics_properties()
+
+
+    def update_statistics_properties(self):
+        self.properties['average_brush_time_week'].update( self.statistics.average_brush_time_week )
+        self.properties['average_brush_time_month'].update( self.statistics.average_brush_time_month )
+        self.properties['goal_hit_rate'].update( self.statistics.goal_hit_rate )
+        self.properties['sector_balance'].update( self.statistics.sector_balance() )
+        self.properties['streak'].update( self.statistics.current_streak )
+
+
         
 
 
@@ -801,53 +1592,35 @@ class ToothbrushProperty(Property):
         #print("set_value is called on a Toothbrush property by the UI. This should not be possible in this case?")
         
         if self.title == 'privacy':
-            try:
-                if value == None:
-                    value = False
-                if self.device.adapter.DEBUG: 
-                    print("toothbrush privacy state is changing to: ", value)
-                if self.device.adapter.persistent_data['toothbrushes'] and self.device.adapter.persistent_data['toothbrushes'][self.device.id]:
-                    if self.device.adapter.persistent_data['toothbrushes'][self.device.id]['privacy'] and self.device.adapter.persistent_data['toothbrushes'][self.device.id]['privacy'] != None:
-                        self.device.adapter.persistent_data['toothbrushes'][self.device.id]['privacy'] = bool(value)
-                    else:
-                        self.device.adapter.persistent_data['toothbrushes'][self.device.id]['privacy'] = bool(value)
-                    self.device.adapter.save_persistent_data()
-                        #print("saved privacy preference to persistent data")
-                else:
-                    if self.device.adapter.DEBUG: 
-                        print("Error, device not found in persistent data?")
-                
-            except Exception as ex:
-                if self.device.adapter.DEBUG: 
-                    print("set_value: caught error: could not find toothbrush_thing_id?: ", self.device.id, ex)
+            if value == None:
+                value = False
+            if self.device.adapter.DEBUG: 
+                print("toothbrush privacy state is changing to: ", value)
+            self.device.settings.privacy = bool(value)
+            self.device.save_settings()
+            self.update(self.device.settings.privacy)
         
         if self.title == 'brush_time_goal':
+            if value == None:
+                value = 9
             try:
-                if value == None:
-                    value = 9
-                    
-                if self.device.adapter.persistent_data['toothbrushes'] and self.device.adapter.persistent_data['toothbrushes'][self.device.id]:
-                    self.device.adapter.persistent_data['toothbrushes'][self.device.id]['brush_time_goal'] = int(value)
-                    self.device.adapter.save_persistent_data()
-                    #print("saved brush_time_goal preference to persistent data")
-                
+                self.device.settings.brush_time_goal = ToothbrushSettings.valid_brush_time_goal(value)
             except Exception as ex:
                 if self.device.adapter.DEBUG: 
-                    print("set_value: caught error: could not find toothbrush_thing_id?: ", self.device.id, ex)
+                    print("set_value: invalid brush_time_goal: ", value, ex)
+                return
+            self.device.save_settings()
+            self.update(self.device.settings.brush_time_goal)
 
 
 
     def update(self, value):
         
         if value != self.value:
-            if self.device.adapter.DEBUG: 
-                print("Toothbrush property: "  + str(self.title) + ", -> update to: " + str(value))
+            _LOGGER.debug("Toothbrush property: %s -> update to: %s", self.title, value)
             self.value = value
             self.set_cached_value(value)
             self.device.notify_property_changed(self)
-        else:
-            if self.device.adapter.DEBUG: 
-                print("Toothbrush property: "  + str(self.title) + ", was already this value: " + str(value))
             
                 
 
@@ -856,171 +1629,28 @@ class ToothbrushProperty(Property):
 
 
 
-class OralB:
-    """Connects to OralB toothbrush to get information."""
+class PollScheduler:
+    """Decides how long to wait before polling a toothbrush again."""
 
-    def __init__(self, ble_device: BLEDevice) -> None:
-        """Initialize the class object."""
-        self.ble_device = ble_device
-        self._cached_services = None
-        self.client = None
-        self.name = "OralB"
-        self.prev_time = 0
+    def __init__(self, max_idle_interval=_MAX_IDLE_POLL_INTERVAL) -> None:
+        self.max_idle_interval = max_idle_interval
+        self.idle_polls = 0
+        self.failures = 0
 
-        self.result = {
-            "brush_time": None,
-            "battery": None,
-            "status": None,
-            "mode": None,
-            "sector": None,
-            "pressure": None,
-            "sector_time": None,
-        }
+    def reset(self) -> None:
+        self.idle_polls = 0
+        self.failures = 0
 
-    def set_ble_device(self, ble_device) -> None:
-        self.ble_device = ble_device
-
-    def disconnect(self) -> None:
-        self.client = None
-        self.ble_device = None
-
-    async def connect(self) -> None:
-        """Ensure connection to device is established."""
-        if self.client and self.client.is_connected:
-            return
-
-        # Check again while holding the lock
-        if self.client and self.client.is_connected:
-            return
-        _LOGGER.debug(f"{self.name}: Connecting; RSSI: {self.ble_device.rssi}")
-        try:
-            self.client = await establish_connection(
-                BleakClient,
-                self.ble_device,
-                self.name,
-                self._disconnected,
-                cached_services=self._cached_services,
-                ble_device_callback=lambda: self.ble_device,
-            )
-            _LOGGER.debug(f"{self.name}: Connected; RSSI: {self.ble_device.rssi}")
-        except Exception as ex:
-            _LOGGER.debug(f"{self.name}: Error connecting to device: ", ex)
-
-    def _disconnected(self, client: BleakClient) -> None:
-        """Disconnected callback."""
-        print(
-            f"{self.name}: Disconnected from device; RSSI: {self.ble_device.rssi}"
-        )
-        self.client = None
-
-    async def gatherdata(self):
-        """Connect to the OralB to get data."""
-        if self.ble_device is None:
-            #print("gatherdata: self.ble_device is None, aborting")
-            return self.result
-        if time.time() - self.prev_time < 1:
-            #print("gatherdata: already scanned less than a second ago, aborting")
-            return self.result
-        self.prev_time = time.time()
-        #print("gatherdata: trying to connect...")
-        await self.connect()
-        #print("gatherdata: connected!")
-        chars = {
-            # a0f0fff0-5047-4d53-8208-4f72616c2d42
-            "a0f0ff08-5047-4d53-8208-4f72616c2d42": "time",
-            "a0f0ff05-5047-4d53-8208-4f72616c2d42": "battery",
-            "a0f0ff04-5047-4d53-8208-4f72616c2d42": "status",
-            "a0f0ff07-5047-4d53-8208-4f72616c2d42": "mode",
-            "a0f0ff09-5047-4d53-8208-4f72616c2d42": "sector",
-            "a0f0ff0b-5047-4d53-8208-4f72616c2d42": "pressure",
-        }
-        statuses = {
-            2: "IDLE",
-            3: "RUN",
-        }
-        modes = {
-            0: "OFF",
-            1: "DAILY_CLEAN",
-            7: "INTENSE",
-            2: "SENSITIVE",
-            4: "WHITEN",
-            3: "GUM_CARE",
-            6: "TONGUE_CLEAN",
-        }
-        sectors = {
-            0: "SECTOR_1",
-            1: "SECTOR_2",
-            2: "SECTOR_3",
-            3: "SECTOR_4",
-            4: "SECTOR_5",
-            5: "SECTOR_6",
-            7: "SECTOR_7",
-            8: "SECTOR_8",
-            "FE": "LAST_SECTOR",
-            "FF": "NO_SECTOR",
-        }
-        passive_pressures = {
-            0: "normal",
-            16: "normal",
-            32: "normal",
-            48: "normal",
-            50: "normal",
-            56: "power button pressed",
-            80: "normal",
-            82: "normal",
-            86: "button pressed",
-            90: "power button pressed",
-            114: "normal",
-            118: "button pressed",
-            122: "power button pressed",
-            144: "high",
-            146: "high",
-            150: "button pressed",
-            154: "power button pressed",
-            178: "high",
-            182: "button pressed",
-            186: "power button pressed",
-            192: "high",
-            240: "high",
-            242: "high",
-        }
-        pressures = {
-            0: -1, #"low", 
-            1: 0, #"normal", 
-            2: 1, #"high"
-        }
-       
-        try:
-            tasks = []
-            if self.client:
-                for char, _ in chars.items():
-                    tasks.append(asyncio.create_task(self.client.read_gatt_char(char)))
-                    #print("gatherdata: appended read task")
-                results = await asyncio.gather(*tasks)
-                #print("gatherdata: all tasks complete!")
-                res_dict = dict(zip(chars.values(), results))
-                print("res_dict: ", res_dict)
-
-
-                self.result["brush_time"] = 60 * res_dict["time"][0] + res_dict["time"][1]
-                self.result["battery"] = res_dict["battery"][0]
-                self.result["status"] = statuses.get(res_dict["status"][0], "UNKNOWN")
-                self.result["mode"] = modes.get(res_dict["mode"][0], "UNKNOWN")
-                self.result["sector"] = sectors.get(res_dict["sector"][0], "UNKNOWN")
-                self.result["sector_time"] = res_dict["sector"][1]
-            
-                try:
-                    self.result["pressure"] = res_dict["pressure"][0] #int(res_dict["pressure"][0]) - 1 #pressures.get(, "UNKNOWN")
-                    #self.result["pressure"] = pressures.get(res_dict["pressure"][0], None)
-                except Exception as ex:
-                    print(f"{self.name}: caught error getting pressure data: ", ex)
-                    self.result["pressure"] = None
-            
-        except Exception as ex:
-           print(f"{self.name}: Not connected to device: ", ex)
+    def next_delay(self, status, succeeded) -> float:
+        """Poll quickly while brushing, back off exponentially while idle or unreachable."""
+        if not succeeded:
+            self.failures += 1
+            return min(_POLL_INTERVAL * (2 ** self.failures), _MAX_POLL_BACKOFF)
+        self.failures = 0
         
-        #print("result: ", self.result)
-
-        return self.result
-
-
+        if status == "RUN":
+            self.idle_polls = 0
+            return _POLL_INTERVAL
+        
+        self.idle_polls += 1
+        return min(_POLL_INTERVAL * (2 ** self.idle_polls), self.max_idle_interval)